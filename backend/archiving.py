@@ -0,0 +1,88 @@
+"""
+Hot/cold tiering of sessions.
+
+Usage (e.g. from cron):
+    python -m backend.archiving [--horizon-days 90]
+
+The same run also prunes delta-sync tombstones older than
+``TOMBSTONE_RETENTION_DAYS``, which keeps that work out of every delete.
+
+Dashboard traffic is almost entirely about upcoming and recent sessions, so
+completed and cancelled sessions scheduled before a horizon
+(``SESSION_ARCHIVE_HORIZON_DAYS``, default 90) are moved from ``sessions``
+into ``sessions_archive``. The move happens in batches, each in its own
+transaction, which keeps locks short on a busy table.
+
+Default reads in ``crud`` only touch the hot table. ``include_archived=True``
+unions both tiers, status analytics always count both, and reports read both.
+Archived sessions leave the default view, so a session tombstone is written
+for each one and delta-sync clients drop them as well.
+
+Archived rows keep their IDs, so those IDs must never be given to new
+sessions. ``sessions`` uses AUTOINCREMENT on SQLite. Older MySQL versions
+reset the counter to ``MAX(id) + 1`` on restart, so the newest session by ID
+is never archived. That keeps it above every archived ID.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+
+from . import crud, models
+
+SESSION_ARCHIVE_HORIZON_DAYS = int(os.getenv("SESSION_ARCHIVE_HORIZON_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("SESSION_ARCHIVE_BATCH_SIZE", "1000"))
+
+ARCHIVABLE_STATUSES = (models.SessionStatus.completed, models.SessionStatus.cancelled)
+
+
+def archive_sessions(db: Session, horizon_days: Optional[int] = None, batch_size: Optional[int] = None) -> int:
+    """Move finished sessions older than the horizon to sessions_archive; returns how many moved."""
+    horizon_days = SESSION_ARCHIVE_HORIZON_DAYS if horizon_days is None else horizon_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=horizon_days)
+    columns = crud.SESSION_COLUMNS
+
+    moved = 0
+    newest_id = db.query(func.max(models.Session.id)).scalar()
+    while newest_id is not None:
+        ids = [session_id for (session_id,) in db.query(models.Session.id).filter(
+            models.Session.status.in_(ARCHIVABLE_STATUSES),
+            models.Session.scheduled_date < cutoff,
+            models.Session.id < newest_id,
+        ).order_by(models.Session.id).limit(batch_size)]
+        if not ids:
+            break
+
+        db.execute(insert(models.ArchivedSession).from_select(
+            columns + ["archived_at"],
+            select(
+                *[getattr(models.Session, column) for column in columns], literal(now).label("archived_at")
+            ).where(models.Session.id.in_(ids)),
+        ))
+        db.execute(delete(models.Session).where(models.Session.id.in_(ids)))
+        db.add_all(models.Tombstone(entity_type="session", entity_id=session_id) for session_id in ids)
+        db.commit()
+        moved += len(ids)
+    return moved
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Move finished sessions older than the horizon to the archive.")
+    parser.add_argument("--horizon-days", type=int, default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(f"Archived {archive_sessions(db, horizon_days=args.horizon_days)} sessions")
+        print(f"Pruned {crud.prune_tombstones(db)} expired tombstones")
+    finally:
+        db.close()
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the Training Management API.
+
+Each benchmark works on synthetic in-memory data, so no database is needed
+unless stated otherwise. Benchmarks that need one use the configured database
+inside a transaction that is rolled back at the end; point DATABASE_URL at a
+scratch database (e.g. sqlite:///bench.db) to keep them away from real data.
+
+Usage:
+    python -m backend.benchmark serialization [--rows 10000]
+    DB_ECHO=0 python -m backend.benchmark schedule [--sessions 100000]   # needs a database
+    python -m backend.benchmark search [--users 500000]
+    python -m backend.benchmark login [--attackers 8] [--attack-rate 50]
+    python -m backend.benchmark cache [--users 100000] [--zipf 1.1] [--db-ms 0.3]
+    DB_ECHO=0 python -m backend.benchmark writes [--rows 2000]             # needs a database
+    python -m backend.benchmark ws-soak [--hours 4] [--clients 2000] [--half-open 0.3]
+"""
+
+import argparse
+import json
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import List
+
+
+def _timed(func, repeat: int = 5):
+    """Return the best wall time of func() over repeat runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@contextmanager
+def _scratch_session():
+    """A DB session whose work is rolled back on exit."""
+    from . import models
+    from .database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    connection = engine.connect()
+    transaction = connection.begin()
+    db = SessionLocal(bind=connection)
+    try:
+        yield db
+    finally:
+        db.close()
+        transaction.rollback()
+        connection.close()
+
+
+def _insert_users(db, count: int, role: str, offset: int = 0) -> List[int]:
+    from . import models
+
+    now = datetime.utcnow()
+    db.execute(models.User.__table__.insert(), [
+        {"username": f"bench_{role}_{offset + i}", "email": f"bench_{role}_{offset + i}@example.com",
+         "password_hash": "x", "role": role, "first_name": "Bench", "last_name": role.title(),
+         "is_temporary_password": False, "created_at": now, "updated_at": now}
+        for i in range(count)
+    ])
+    rows = db.query(models.User.id).filter(models.User.username.like(f"bench_{role}_%")).all()
+    return [user_id for (user_id,) in rows]
+
+
+def _user_record(user_id: int, created_at: datetime, updated_at: datetime) -> dict:
+    """A synthetic schemas.User as a dict; rows are built from it in serialization.USER_FIELDS order."""
+    from . import schemas
+
+    return {"username": f"user{user_id}", "email": f"user{user_id}@example.com", "role": schemas.UserRole.trainee,
+            "first_name": "First", "last_name": "Last", "id": user_id, "is_temporary_password": False,
+            "created_at": created_at, "updated_at": updated_at, "version": 1}
+
+
+def bench_schedule(sessions: int, checks: int = 2000):
+    """Indexed overlap lookups vs loading each user's whole calendar."""
+    from . import models, scheduling
+
+    trainer_count, trainee_count = max(1, sessions // 500), max(1, sessions // 50)
+    base = datetime(2025, 1, 1, 8, 0)
+    with _scratch_session() as db:
+        trainer_ids = _insert_users(db, trainer_count, "trainer")
+        trainee_ids = _insert_users(db, trainee_count, "trainee")
+        now = datetime.utcnow()
+        rows = [
+            {"title": "Bench", "trainer_id": trainer_ids[i % trainer_count],
+             "trainee_id": trainee_ids[i % trainee_count],
+             "scheduled_date": base + timedelta(hours=2 * (i // trainer_count)),
+             "duration_minutes": 60, "status": "scheduled", "created_at": now, "updated_at": now}
+            for i in range(sessions)
+        ]
+        for start in range(0, len(rows), 10000):
+            db.execute(models.Session.__table__.insert(), rows[start:start + 10000])
+        print(f"{sessions:,} sessions, {trainer_count} trainers, {trainee_count} trainees")
+
+        rng = random.Random(42)
+        span_hours = 2 * (sessions // trainer_count)
+        probes = [
+            (rng.choice(trainer_ids), rng.choice(trainee_ids), base + timedelta(minutes=rng.randrange(span_hours * 60)))
+            for _ in range(checks)
+        ]
+
+        def indexed():
+            for trainer_id, trainee_id, start in probes:
+                scheduling.find_conflicts(db, [trainer_id, trainee_id], start, 60)
+
+        def naive():
+            for trainer_id, trainee_id, start in probes[:checks // 10]:
+                end = start + timedelta(minutes=60)
+                calendar = db.query(models.Session).filter(
+                    (models.Session.trainer_id == trainer_id) | (models.Session.trainee_id == trainee_id)
+                ).all()
+                [s.id for s in calendar if s.scheduled_date < end and s.scheduled_date + timedelta(minutes=s.duration_minutes) > start]
+                db.expunge_all()
+
+        elapsed = _timed(indexed, repeat=1)
+        print(f"{'indexed range query':<24} {elapsed / checks * 1e6:8.0f} us/check")
+        elapsed = _timed(naive, repeat=1)
+        print(f"{'full calendar scan':<24} {elapsed / (checks // 10) * 1e6:8.0f} us/check")
+
+        week = [(rng.choice(trainer_ids), rng.choice(trainee_ids)) for _ in range(checks // 10)]
+
+        def slots():
+            for trainer_id, trainee_id in week:
+                scheduling.find_free_slots(db, [trainer_id, trainee_id], base, base + timedelta(days=7), 60)
+
+        elapsed = _timed(slots, repeat=1)
+        print(f"{'free slots (1 week)':<24} {elapsed / len(week) * 1e6:8.0f} us/query")
+
+
+def bench_serialization(rows: int):
+    """Compare response_model validation + json against the row tuple path."""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from . import schemas, serialization
+
+    now = datetime.utcnow()
+    user_rows = [
+        tuple(_user_record(i, now - timedelta(days=i % 365), now)[field] for field in serialization.USER_FIELDS)
+        for i in range(rows)
+    ]
+    user_objects = [SimpleNamespace(**dict(zip(serialization.USER_FIELDS, row))) for row in user_rows]
+    adapter = TypeAdapter(List[schemas.User])
+
+    def response_model_path():
+        validated = adapter.validate_python(user_objects, from_attributes=True)
+        json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+    def row_tuple_path():
+        serialization.dumps(serialization.rows_to_dicts(serialization.USER_FIELDS, user_rows))
+
+    for name, func in (("response_model + json", response_model_path), ("row tuples + orjson", row_tuple_path)):
+        elapsed = _timed(func)
+        print(f"{name:<24} {elapsed * 1000:8.1f} ms  {rows / elapsed:12,.0f} rows/s")
+
+
+def bench_search(users: int, queries: int = 2000):
+    """Top-10 latency of the user search index."""
+    import gc
+    import resource
+    import statistics
+
+    from .search import UserSearchIndex
+
+    rng = random.Random(42)
+    first_names = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+                   "Aarav", "Priya", "Wei", "Mei", "Olu", "Ngozi", "Carlos", "Lucia", "Yusuf", "Fatima"]
+    syllables = ["son", "ber", "man", "ko", "ra", "li", "ton", "vic", "ez", "ova", "sh", "ar", "en", "da", "mi"]
+    roles = ["trainee"] * 8 + ["trainer"] + ["admin"]
+
+    def surname():
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).title()
+
+    rows = []
+    for user_id in range(1, users + 1):
+        first, last = rng.choice(first_names), surname()
+        username = f"{first[0].lower()}{last.lower()}{user_id}"
+        rows.append((user_id, rng.choice(roles), username, f"{username}@example.com", first, last))
+
+    index = UserSearchIndex()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    index.build(rows)
+    build_seconds = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"built {users:,} users in {build_seconds:.1f} s, ~{(rss_after - rss_before) / 1024:,.0f} MiB")
+    # The index is long-lived; keep it out of full GC passes as a server would after warmup
+    gc.freeze()
+
+    samples = []
+    for _ in range(queries):
+        _, role, username, _, first, last = rng.choice(rows)
+        text = rng.choice([username[:rng.randint(2, 6)], last[1:rng.randint(4, 7)].lower(), first[:3], last])
+        start = time.perf_counter()
+        index.search(text, role=rng.choice([None, role]), limit=10)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(f"top-10 search: p50 {statistics.median(samples):.2f} ms, p95 {samples[int(len(samples) * 0.95)]:.2f} ms, "
+          f"p99 {samples[int(len(samples) * 0.99)]:.2f} ms")
+
+
+def bench_login(attackers: int, attack_rate: float, legit_logins: int = 40):
+    """Legitimate login latency while attackers each send attack_rate attempts/s."""
+    import statistics
+    import threading
+
+    from passlib.context import CryptContext
+
+    from .ratelimit import LoginThrottle, TokenBucketLimiter
+
+    pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+    password_hash = pwd_context.hash("secret")
+
+    def login(throttle, ip, username, password):
+        if throttle is not None and throttle.check(ip, username):
+            return 429
+        if not pwd_context.verify(password, password_hash):
+            return 401
+        if throttle is not None:
+            throttle.succeeded(ip, username)
+        return 200
+
+    def run(throttle, attacker_count):
+        stop = threading.Event()
+        attempts = [0]
+
+        def attack(number):
+            interval = 1.0 / attack_rate
+            while not stop.is_set():
+                start = time.perf_counter()
+                login(throttle, f"10.0.0.{number}", "admin", "guess")
+                attempts[0] += 1
+                stop.wait(max(0.0, interval - (time.perf_counter() - start)))
+
+        threads = [threading.Thread(target=attack, args=(number,)) for number in range(attacker_count)]
+        for thread in threads:
+            thread.start()
+        samples = []
+        for number in range(legit_logins):
+            start = time.perf_counter()
+            login(throttle, f"192.168.1.{number}", f"user{number}", "secret")
+            samples.append((time.perf_counter() - start) * 1000)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        samples.sort()
+        return statistics.median(samples), samples[int(len(samples) * 0.95)], attempts[0]
+
+    def fresh_throttle():
+        return LoginThrottle(TokenBucketLimiter(20, 20, 100000), TokenBucketLimiter(5, 5, 100000),
+                             TokenBucketLimiter(50, 30, 100000))
+
+    for name, throttle, attacker_count in (
+        ("no attack", None, 0),
+        ("attack, no throttle", None, attackers),
+        ("attack, throttled", fresh_throttle(), attackers),
+    ):
+        p50, p95, attempts = run(throttle, attacker_count)
+        print(f"{name:<22} legit p50 {p50:7.1f} ms  p95 {p95:7.1f} ms  ({attempts:,} attack attempts)")
+
+
+def bench_cache(users: int, zipf: float, db_ms: float, requests: int = 50000):
+    """/users/{id} throughput on a Zipf-distributed ID workload, with and without the entity cache.
+
+    The uncached path validates a schemas.User and encodes it as FastAPI's
+    response_model would, after a simulated database round trip of db_ms.
+    """
+    from fastapi.encoders import jsonable_encoder
+
+    from . import schemas
+    from .entity_cache import EntityCache
+
+    now = datetime.utcnow()
+    records = {user_id: SimpleNamespace(**_user_record(user_id, now, now)) for user_id in range(1, users + 1)}
+
+    rng = random.Random(42)
+    cumulative, total = [], 0.0
+    for rank in range(1, users + 1):
+        total += 1.0 / rank ** zipf
+        cumulative.append(total)
+    # Popularity ranks are shuffled over IDs so hot users are not adjacent
+    ids = list(records)
+    rng.shuffle(ids)
+    workload = rng.choices(ids, cum_weights=cumulative, k=requests)
+
+    def load(user_id):
+        if db_ms:
+            time.sleep(db_ms / 1000)
+        user = schemas.User.model_validate(records[user_id])
+        return json.dumps(jsonable_encoder(user)).encode("utf-8"), user.updated_at
+
+    def uncached():
+        for user_id in workload[:requests // 20]:
+            load(user_id)
+
+    elapsed = _timed(uncached, repeat=1)
+    print(f"{'no cache':<22} {requests // 20 / elapsed:10,.0f} req/s")
+
+    entry_bytes = len(load(1)[0])
+    for share in (0.01, 0.05, 0.2):
+        cache = EntityCache(int(users * share) * (entry_bytes + 200))
+
+        def cached():
+            for user_id in workload:
+                if cache.get(("user", user_id)) is None:
+                    cache.put(("user", user_id), *load(user_id))
+
+        elapsed = _timed(cached, repeat=1)
+        stats = cache.stats()
+        print(f"cache {share:>4.0%} of users    {requests / elapsed:10,.0f} req/s  hit ratio {stats['hit_ratio']:.3f}  "
+              f"{stats['bytes'] / 1024 / 1024:6.1f} MiB")
+
+
+def bench_writes(rows: int):
+    """Per-connection update/delete throughput: ORM load-mutate-refresh vs crud's single statements."""
+    from . import crud, models, query_diagnostics, schemas
+
+    with _scratch_session() as db:
+        trainer_id = _insert_users(db, 1, "trainer")[0]
+        trainee_id = _insert_users(db, 1, "trainee")[0]
+        now = datetime.utcnow()
+        db.execute(models.Session.__table__.insert(), [
+            {"title": "Bench", "trainer_id": trainer_id, "trainee_id": trainee_id,
+             "scheduled_date": datetime(2025, 1, 1) + timedelta(hours=2 * i), "duration_minutes": 60,
+             "status": "completed", "created_at": now, "updated_at": now}
+            for i in range(2 * rows)
+        ])
+        ids = [session_id for (session_id,) in db.query(models.Session.id).filter(models.Session.title == "Bench")]
+        orm_ids, statement_ids = ids[:rows], ids[rows:2 * rows]
+
+        def orm_update(session_id):
+            # The previous crud.update_session
+            db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
+            db_session.title = "Renamed"
+            db_session.updated_at = datetime.utcnow()
+            db.commit()
+            db.refresh(db_session)
+
+        def orm_delete(session_id):
+            db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
+            db.delete(db_session)
+            crud.add_tombstone(db, "session", session_id)
+            db.commit()
+
+        for name, operation, session_ids in (
+            ("ORM update", orm_update, orm_ids),
+            ("single-statement update", lambda session_id: crud.update_session(
+                db, session_id, schemas.SessionUpdate(title="Renamed")), statement_ids),
+            ("ORM delete", orm_delete, orm_ids),
+            ("single-statement delete", lambda session_id: crud.delete_session(db, session_id), statement_ids),
+        ):
+            with query_diagnostics.track() as collector:
+                start = time.perf_counter()
+                for session_id in session_ids:
+                    operation(session_id)
+                elapsed = time.perf_counter() - start
+            print(f"{name:<24} {rows / elapsed:10,.0f} ops/s  {collector.total / rows:4.1f} statements/op")
+
+
+def bench_ws_soak(hours: float, clients: int, half_open: float):
+    """Connection churn on realtime.ConnectionManager over simulated hours, with and without heartbeats.
+
+    Clients connect, stay for a random lifetime and leave. A share of them
+    vanish without closing (half_open). Their sockets still accept sends, and
+    the frames they never read pile up as a kernel send buffer would. Time is
+    simulated: the manager's clock is advanced in 5 s ticks and heartbeats run
+    at the configured WS_PING_INTERVAL_SECONDS and WS_PONG_TIMEOUT_SECONDS.
+    """
+    import asyncio
+    import tracemalloc
+
+    from .realtime import PING_FRAME, WS_PING_INTERVAL_SECONDS, WS_PONG_TIMEOUT_SECONDS, ConnectionManager
+
+    class FakeSocket:
+        __slots__ = ("manager", "responsive", "unread")
+
+        def __init__(self, manager, responsive):
+            self.manager = manager
+            self.responsive = responsive
+            self.unread = []
+
+        async def accept(self, subprotocol=None):
+            pass
+
+        async def send_text(self, text):
+            if not self.responsive:
+                self.unread.append(text)
+            elif text == PING_FRAME:
+                self.manager.received(self)
+
+        async def close(self, code=1000):
+            self.unread = []
+
+    event = SimpleNamespace(model_dump=lambda **kwargs: {"session_id": 1, "status": "scheduled"})
+    mean_lifetime = 1800  # half an hour per visit
+    tick = 5
+    broadcast_every = 60
+    duration = hours * 3600
+
+    async def run(heartbeats):
+        rng = random.Random(42)
+        clock = SimpleNamespace(now=0.0)
+        # Heartbeats are driven here, on the simulated clock
+        manager = ConnectionManager(ping_interval=None, max_per_user=clients, max_connections=10 * clients,
+                                    clock=lambda: clock.now)
+        leaving = []  # (time, socket) of clients that will close cleanly
+        next_ping = next_broadcast = next_report = 0.0
+        next_reap = None
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        while clock.now < duration:
+            # Arrivals keep about `clients` visits in progress
+            for _ in range(rng.randint(0, round(2 * clients * tick / mean_lifetime))):
+                socket = FakeSocket(manager, rng.random() >= half_open)
+                await manager.connect(socket, rng.randrange(clients))
+                if socket.responsive:
+                    leaving.append((clock.now + rng.expovariate(1 / mean_lifetime), socket))
+            still_here = []
+            for leave_at, socket in leaving:
+                if leave_at <= clock.now:
+                    manager.disconnect(socket)
+                else:
+                    still_here.append((leave_at, socket))
+            leaving = still_here
+            if heartbeats and clock.now >= next_ping:
+                await manager.ping()
+                next_reap = clock.now + WS_PONG_TIMEOUT_SECONDS
+                next_ping += WS_PING_INTERVAL_SECONDS
+            if next_reap is not None and clock.now >= next_reap:
+                await manager.reap_silent()
+                next_reap = None
+            if clock.now >= next_broadcast:
+                await manager.broadcast("session_updated", event)
+                next_broadcast += broadcast_every
+            if clock.now >= next_report:
+                heap = (tracemalloc.get_traced_memory()[0] - baseline) / 1024 / 1024
+                stats = manager.stats()
+                print(f"  {clock.now / 3600:5.1f} h  live {stats['live']:7,}  heap +{heap:6.1f} MiB  "
+                      f"timed out {stats['closed'].get('timed_out', 0):7,}  "
+                      f"disconnected {stats['closed'].get('disconnected', 0):7,}")
+                next_report += duration / 8
+            clock.now += tick
+        tracemalloc.stop()
+
+    for heartbeats in (False, True):
+        print("heartbeats on" if heartbeats else "heartbeats off")
+        asyncio.run(run(heartbeats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    serialization_parser = subparsers.add_parser("serialization", help="list endpoint serialization")
+    serialization_parser.add_argument("--rows", type=int, default=10000)
+
+    schedule_parser = subparsers.add_parser("schedule", help="conflict detection and free slots")
+    schedule_parser.add_argument("--sessions", type=int, default=100000)
+
+    search_parser = subparsers.add_parser("search", help="user search index")
+    search_parser.add_argument("--users", type=int, default=500000)
+
+    login_parser = subparsers.add_parser("login", help="login latency under a credential-stuffing flood")
+    login_parser.add_argument("--attackers", type=int, default=8)
+    login_parser.add_argument("--attack-rate", type=float, default=50, help="attempts per second per attacker")
+
+    cache_parser = subparsers.add_parser("cache", help="entity cache on a Zipf workload")
+    cache_parser.add_argument("--users", type=int, default=100000)
+    cache_parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of ID popularity")
+    cache_parser.add_argument("--db-ms", type=float, default=0.3, help="simulated database round trip per miss")
+
+    writes_parser = subparsers.add_parser("writes", help="update/delete throughput per connection")
+    writes_parser.add_argument("--rows", type=int, default=2000)
+
+    soak_parser = subparsers.add_parser("ws-soak", help="WebSocket connection churn over simulated hours")
+    soak_parser.add_argument("--hours", type=float, default=4)
+    soak_parser.add_argument("--clients", type=int, default=2000, help="concurrent visits in progress")
+    soak_parser.add_argument("--half-open", type=float, default=0.3, help="share of clients that vanish without closing")
+
+    args = parser.parse_args()
+    if args.benchmark == "serialization":
+        bench_serialization(args.rows)
+    elif args.benchmark == "schedule":
+        bench_schedule(args.sessions)
+    elif args.benchmark == "search":
+        bench_search(args.users)
+    elif args.benchmark == "login":
+        bench_login(args.attackers, args.attack_rate)
+    elif args.benchmark == "cache":
+        bench_cache(args.users, args.zipf, args.db_ms)
+    elif args.benchmark == "writes":
+        bench_writes(args.rows)
+    elif args.benchmark == "ws-soak":
+        bench_ws_soak(args.hours, args.clients, args.half_open)
+
+
+if __name__ == "__main__":
+    main()
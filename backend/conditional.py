@@ -0,0 +1,119 @@
+"""
+Conditional GET support (ETag / Last-Modified).
+
+List and analytics routes derive a strong ETag from ``COUNT(id)``,
+``MAX(id)``, ``SUM(version)`` and ``MAX(updated_at)`` of the tables they
+read. ``updated_at`` alone is not enough, because MySQL stores it to the
+second. Every update bumps its row's ``version``, inserts take a new highest
+ID, and deletes change the count, so writes within the same second still
+change the tag. Computing it is one aggregate query per table. A matching
+``If-None-Match`` is answered with 304 before any rows are loaded or
+serialized.
+Compressed responses carry the tag with a "-gzip" or "-br" suffix. Those
+tags match too, and the 304 echoes the suffixed tag the client sent.
+
+Single-resource routes use the row's ``updated_at`` as ``Last-Modified``.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+CACHE_CONTROL = "private, no-cache"
+
+# Compressed representations carry their coding as an ETag suffix
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def table_etag(db: Session, *models, extra: str = "") -> str:
+    parts = [extra]
+    for model in models:
+        # Tables without a version column are insert/delete only
+        version_sum = func.sum(model.version) if hasattr(model, "version") else func.count(model.id)
+        count, max_id, versions, last_updated = db.query(
+            func.count(model.id), func.max(model.id), version_sum, func.max(model.updated_at)
+        ).one()
+        parts.append(f"{model.__tablename__}:{count}:{max_id}:{versions}:{last_updated.isoformat() if last_updated else ''}")
+    digest = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _strip_encoding(tag: str) -> str:
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(f'{suffix}"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def etag_matches(request: Request, etag: str) -> Optional[str]:
+    """The If-None-Match tag matching etag in any encoding, or None.
+
+    A 304 must carry the ETag of the variant the client holds, so callers
+    echo the returned tag (e.g. its "-gzip" form) rather than etag itself.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() == "*":
+        return etag
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if _strip_encoding(tag) == etag:
+            return tag
+    return None
+
+
+def http_date(value: datetime) -> str:
+    # Timestamps are stored as naive UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value, usegmt=True)
+
+
+def not_modified_since(request: Request, last_modified: datetime) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.1.3)
+    if request.headers.get("if-none-match"):
+        return False
+    header = request.headers.get("if-modified-since")
+    if not header:
+        return False
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return last_modified.replace(microsecond=0) <= since
+
+
+def validator_headers(etag: Optional[str] = None, last_modified: Optional[datetime] = None) -> dict:
+    headers = {"Cache-Control": CACHE_CONTROL}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(etag: Optional[str] = None, last_modified: Optional[datetime] = None,
+                 vary: Optional[str] = None) -> Response:
+    # Send the same Vary as the 200 would, so caches keep variants apart
+    headers = validator_headers(etag, last_modified)
+    if vary:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
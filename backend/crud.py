@@ -1,13 +1,69 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
 from passlib.context import CryptContext
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import os
 
-from . import models, schemas
+from . import models, schemas, scheduling, search, entity_cache, recurrence
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "30"))
+# updated_at/deleted_at are stamped by the app before commit, so a row can
+# become visible after a reader's watermark has passed its timestamp. Change
+# queries therefore look back this much further (longest write transaction
+# plus clock skew between app servers); readers must treat repeats as upserts.
+SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "30"))
+
+class VersionConflict(Exception):
+    """An update carried a version the row no longer has."""
+    def __init__(self, current_version: int):
+        self.current_version = current_version
+        super().__init__(f"Row is at version {current_version}")
+
+# Updates and deletes are single statements on the table. Updates bump the
+# row's version and, where the backend supports UPDATE ... RETURNING, get the
+# new row back from the same statement; otherwise it is read back by id.
+def _update_row(db: Session, model, row_id: int, values: dict, expected_version: Optional[int] = None):
+    table = model.__table__
+    statement = table.update().where(table.c.id == row_id).values(
+        **values, updated_at=datetime.utcnow(), version=table.c.version + 1
+    )
+    if expected_version is not None:
+        statement = statement.where(table.c.version == expected_version)
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(statement.returning(*table.c)).first()
+    elif db.execute(statement).rowcount:
+        row = db.execute(select(*table.c).where(table.c.id == row_id)).first()
+    else:
+        row = None
+    if row is None and expected_version is not None:
+        current_version = db.execute(select(table.c.version).where(table.c.id == row_id)).scalar()
+        if current_version is not None:
+            db.rollback()
+            raise VersionConflict(current_version)
+    return row
+
+class UnknownUsers(Exception):
+    """A write referenced trainer/trainee IDs that do not exist."""
+    def __init__(self, user_ids: List[int]):
+        self.user_ids = user_ids
+        super().__init__(f"Unknown users {user_ids}")
+
+def _check_users_exist(db: Session, values: dict):
+    user_ids = {values[field] for field in ("trainer_id", "trainee_id") if values.get(field) is not None}
+    if not user_ids:
+        return
+    known = {user_id for (user_id,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))}
+    if user_ids - known:
+        raise UnknownUsers(sorted(user_ids - known))
+
+def _delete_row(db: Session, model, row_id: int) -> bool:
+    table = model.__table__
+    return db.execute(table.delete().where(table.c.id == row_id)).rowcount > 0
+
 # User CRUD operations
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -18,9 +74,17 @@ def get_user_by_username(db: Session, username: str):
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
+def get_users(db: Session, skip: int = 0, limit: Optional[int] = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
+def get_user_rows(db: Session, fields: List[str], skip: int = 0, limit: int = 100):
+    columns = [getattr(models.User, field) for field in fields]
+    return db.query(*columns).offset(skip).limit(limit).all()
+
+def get_user_rows_by_ids(db: Session, fields: List[str], user_ids: List[int]):
+    columns = [getattr(models.User, field) for field in fields]
+    return db.query(*columns).filter(models.User.id.in_(user_ids)).all()
+
 def get_users_by_role(db: Session, role: models.UserRole):
     return db.query(models.User).filter(models.User.role == role).all()
 
@@ -38,32 +102,31 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    search.user_index.upsert_user(db_user)
     return db_user
 
 def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not db_user:
-        return None
-
     update_data = user_update.dict(exclude_unset=True)
+    expected_version = update_data.pop("version", None)
     if "password" in update_data:
         update_data["password_hash"] = pwd_context.hash(update_data.pop("password"))
 
-    for field, value in update_data.items():
-        setattr(db_user, field, value)
-
-    db_user.updated_at = datetime.utcnow()
+    db_user = _update_row(db, models.User, user_id, update_data, expected_version)
+    if db_user is None:
+        return None
     db.commit()
-    db.refresh(db_user)
+    search.user_index.upsert_user(db_user)
+    entity_cache.cache.invalidate("user", user_id)
     return db_user
 
 def delete_user(db: Session, user_id: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user:
-        db.delete(db_user)
-        db.commit()
-        return True
-    return False
+    if not _delete_row(db, models.User, user_id):
+        return False
+    add_tombstone(db, "user", user_id)
+    db.commit()
+    search.user_index.remove(user_id)
+    entity_cache.cache.invalidate("user", user_id)
+    return True
 
 def authenticate_user(db: Session, username: str, password: str):
     user = get_user_by_username(db, username)
@@ -77,46 +140,258 @@ def authenticate_user(db: Session, username: str, password: str):
 def get_session(db: Session, session_id: int):
     return db.query(models.Session).filter(models.Session.id == session_id).first()
 
-def get_sessions(db: Session, skip: int = 0, limit: int = 100):
+# Reads default to the hot sessions table; include_archived=True also
+# reads sessions_archive (see archiving.py)
+SESSION_COLUMNS = [column.name for column in models.Session.__table__.columns]
+
+def get_archived_session(db: Session, session_id: int):
+    return db.query(models.ArchivedSession).filter(models.ArchivedSession.id == session_id).first()
+
+def get_session_row(db: Session, fields: List[str], session_id: int):
+    for model in (models.Session, models.ArchivedSession):
+        row = db.query(*[getattr(model, field) for field in fields]).filter(model.id == session_id).first()
+        if row is not None:
+            return row
+    return None
+
+def get_sessions(db: Session, skip: int = 0, limit: Optional[int] = 100, include_archived: bool = False):
+    if include_archived:
+        return get_session_rows(db, SESSION_COLUMNS, skip=skip, limit=limit, include_archived=True)
     return db.query(models.Session).offset(skip).limit(limit).all()
 
-def get_sessions_by_trainer(db: Session, trainer_id: int):
-    return db.query(models.Session).filter(models.Session.trainer_id == trainer_id).all()
+def get_session_rows(db: Session, fields: List[str], skip: int = 0, limit: Optional[int] = 100, include_archived: bool = False):
+    query = db.query(*[getattr(models.Session, field) for field in fields])
+    if include_archived:
+        query = query.union_all(db.query(*[getattr(models.ArchivedSession, field) for field in fields]))
+    return query.offset(skip).limit(limit).all()
+
+def get_upcoming_session_rows(db: Session, fields: List[str], since: datetime, limit: int = 10):
+    columns = [getattr(models.Session, field) for field in fields]
+    return db.query(*columns).filter(
+        models.Session.status == models.SessionStatus.scheduled, models.Session.scheduled_date >= since
+    ).order_by(models.Session.scheduled_date).limit(limit).all()
+
+def get_session_partner_rows(db: Session, fields: List[str], user_id: int, role: models.UserRole):
+    # Trainees of a trainer's sessions, or trainers of a trainee's sessions
+    if role == models.UserRole.trainer:
+        partner_ids = db.query(models.Session.trainee_id).filter(models.Session.trainer_id == user_id)
+    else:
+        partner_ids = db.query(models.Session.trainer_id).filter(models.Session.trainee_id == user_id)
+    columns = [getattr(models.User, field) for field in fields]
+    return db.query(*columns).filter(models.User.id.in_(partner_ids)).all()
 
-def get_sessions_by_trainee(db: Session, trainee_id: int):
-    return db.query(models.Session).filter(models.Session.trainee_id == trainee_id).all()
+def _sessions_where(db: Session, include_archived: bool, condition):
+    sessions = db.query(models.Session).filter(condition(models.Session)).all()
+    if include_archived:
+        sessions += db.query(models.ArchivedSession).filter(condition(models.ArchivedSession)).all()
+    return sessions
 
-def get_sessions_by_status(db: Session, status: models.SessionStatus):
-    return db.query(models.Session).filter(models.Session.status == status).all()
+def get_sessions_by_trainer(db: Session, trainer_id: int, include_archived: bool = False):
+    return _sessions_where(db, include_archived, lambda model: model.trainer_id == trainer_id)
+
+def get_sessions_by_trainee(db: Session, trainee_id: int, include_archived: bool = False):
+    return _sessions_where(db, include_archived, lambda model: model.trainee_id == trainee_id)
+
+def get_sessions_by_status(db: Session, status: models.SessionStatus, include_archived: bool = False):
+    return _sessions_where(db, include_archived, lambda model: model.status == status)
+
+def _naive_session_times(values: dict) -> dict:
+    # Stored as naive UTC, the form the overlap checks compare in
+    if values.get("scheduled_date") is not None:
+        values["scheduled_date"] = scheduling.naive_utc(values["scheduled_date"])
+    return values
 
 def create_session(db: Session, session: schemas.SessionCreate):
-    db_session = models.Session(**session.dict())
+    db_session = models.Session(**_naive_session_times(session.dict()))
+    scheduling.check_session(db, db_session)
     db.add(db_session)
     db.commit()
     db.refresh(db_session)
     return db_session
 
 def update_session(db: Session, session_id: int, session_update: schemas.SessionUpdate):
-    db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
-    if not db_session:
+    update_data = _naive_session_times(session_update.dict(exclude_unset=True))
+    expected_version = update_data.pop("version", None)
+
+    db_session = _update_row(db, models.Session, session_id, update_data, expected_version)
+    if db_session is None:
         return None
 
-    update_data = session_update.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(db_session, field, value)
+    # Checked on the updated row inside the still-open transaction
+    if update_data.keys() & {"trainer_id", "trainee_id", "scheduled_date", "duration_minutes", "status"}:
+        try:
+            scheduling.check_session(db, db_session, exclude_session_id=session_id)
+        except scheduling.ScheduleConflict:
+            db.rollback()
+            raise
 
-    db_session.updated_at = datetime.utcnow()
     db.commit()
-    db.refresh(db_session)
+    entity_cache.cache.invalidate("session", session_id)
     return db_session
 
 def delete_session(db: Session, session_id: int):
-    db_session = db.query(models.Session).filter(models.Session.id == session_id).first()
-    if db_session:
-        db.delete(db_session)
-        db.commit()
+    if not _delete_row(db, models.Session, session_id):
+        return False
+    add_tombstone(db, "session", session_id)
+    db.commit()
+    entity_cache.cache.invalidate("session", session_id)
+    return True
+
+# Recurring series operations (see recurrence.py)
+def _naive_series_times(values: dict) -> dict:
+    for field in ("starts_at", "until"):
+        if values.get(field) is not None:
+            values[field] = scheduling.naive_utc(values[field])
+    return values
+
+def get_series(db: Session, series_id: int):
+    return db.query(models.SessionSeries).filter(models.SessionSeries.id == series_id).first()
+
+def create_series(db: Session, series: schemas.SessionSeriesCreate):
+    _check_users_exist(db, series.dict())
+    db_series = models.SessionSeries(**_naive_series_times(series.dict()))
+    db.add(db_series)
+    db.flush()
+    try:
+        recurrence.check_series(db, db_series)
+    except scheduling.ScheduleConflict:
+        db.rollback()
+        raise
+    db.commit()
+    db.refresh(db_series)
+    return db_series
+
+def update_series(db: Session, series_id: int, series_update: schemas.SessionSeriesUpdate):
+    update_data = _naive_series_times(series_update.dict(exclude_unset=True))
+    expected_version = update_data.pop("version", None)
+    _check_users_exist(db, update_data)
+    db_series = _update_row(db, models.SessionSeries, series_id, update_data, expected_version)
+    if db_series is None:
+        return None
+    # Checked on the updated row inside the still-open transaction, as in update_session
+    if update_data.keys() & {"trainer_id", "trainee_id", "starts_at", "duration_minutes", "frequency",
+                             "repeat_every", "until", "occurrence_count"}:
+        try:
+            recurrence.check_series(db, db_series)
+        except scheduling.ScheduleConflict:
+            db.rollback()
+            raise
+    db.commit()
+    return db_series
+
+def delete_series(db: Session, series_id: int):
+    # Occurrences already stored as sessions are kept
+    db.query(models.SeriesException).filter(models.SeriesException.series_id == series_id).delete(synchronize_session=False)
+    if not _delete_row(db, models.SessionSeries, series_id):
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def _get_series_exception(db: Session, series_id: int, occurrence_start: datetime):
+    return db.query(models.SeriesException).filter(
+        models.SeriesException.series_id == series_id,
+        models.SeriesException.occurrence_start == occurrence_start,
+    ).first()
+
+def _series_slot(db: Session, series_id: int, occurrence_start: datetime):
+    series = get_series(db, series_id)
+    if series is None:
+        return None, None
+    occurrence_start = scheduling.naive_utc(occurrence_start)
+    recurrence.check_slot(series, occurrence_start)
+    return series, occurrence_start
+
+def update_occurrence(db: Session, series_id: int, occurrence_start: datetime, session_update: schemas.SessionUpdate):
+    series, occurrence_start = _series_slot(db, series_id, occurrence_start)
+    if series is None:
+        return None
+    changes = _naive_session_times(session_update.dict(exclude_unset=True, exclude={"version"}))
+    _check_users_exist(db, changes)
+    exception = _get_series_exception(db, series_id, occurrence_start)
+    if exception is not None:
+        if exception.session_id is None:
+            raise recurrence.NotAnOccurrence(occurrence_start)  # skipped
+        return update_session(db, exception.session_id, session_update)
+
+    # First change to this occurrence: store it as a session
+    values = {
+        "title": series.title, "description": series.description,
+        "trainer_id": series.trainer_id, "trainee_id": series.trainee_id,
+        "scheduled_date": occurrence_start, "duration_minutes": series.duration_minutes,
+        "status": models.SessionStatus.scheduled,
+    }
+    values.update(changes)
+    db_session = models.Session(**values)
+    db.add(db_session)
+    try:
+        db.flush()
+        db.add(models.SeriesException(series_id=series_id, occurrence_start=occurrence_start, session_id=db_session.id))
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        # Only a concurrent store of the same occurrence (uq_series_exceptions_occurrence)
+        # is retried, as a change to that session; anything else is a real error
+        if _get_series_exception(db, series_id, occurrence_start) is None:
+            raise
+        return update_occurrence(db, series_id, occurrence_start, session_update)
+    try:
+        scheduling.check_session(db, db_session, exclude_session_id=db_session.id)
+    except scheduling.ScheduleConflict:
+        db.rollback()
+        raise
+    db.commit()
+    db.refresh(db_session)
+    return db_session
+
+def skip_occurrence(db: Session, series_id: int, occurrence_start: datetime):
+    series, occurrence_start = _series_slot(db, series_id, occurrence_start)
+    if series is None:
+        return False
+    exception = _get_series_exception(db, series_id, occurrence_start)
+    if exception is None:
+        db.add(models.SeriesException(series_id=series_id, occurrence_start=occurrence_start))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            # Fine if another request took the slot concurrently
+            if _get_series_exception(db, series_id, occurrence_start) is None:
+                raise
         return True
-    return False
+    if exception.session_id is not None:
+        # The slot stays taken by the exception, so the occurrence does not come back
+        delete_session(db, exception.session_id)
+    return True
+
+# Delta sync helpers
+def add_tombstone(db: Session, entity_type: str, entity_id: int):
+    """Record a deletion in the caller's transaction."""
+    db.add(models.Tombstone(entity_type=entity_type, entity_id=entity_id))
+
+def prune_tombstones(db: Session) -> int:
+    """Delete tombstones older than TOMBSTONE_RETENTION_DAYS; run periodically (archiving.py does)."""
+    cutoff = datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    pruned = db.query(models.Tombstone).filter(models.Tombstone.deleted_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+    return pruned
+
+def _with_overlap(since: datetime) -> datetime:
+    return since - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+
+def get_user_rows_updated_since(db: Session, fields: List[str], since: datetime):
+    columns = [getattr(models.User, field) for field in fields]
+    return db.query(*columns).filter(models.User.updated_at >= _with_overlap(since)).all()
+
+def get_session_rows_updated_since(db: Session, fields: List[str], since: datetime):
+    columns = [getattr(models.Session, field) for field in fields]
+    return db.query(*columns).filter(models.Session.updated_at >= _with_overlap(since)).all()
+
+def get_deleted_ids_since(db: Session, entity_type: str, since: datetime):
+    result = db.query(models.Tombstone.entity_id).filter(
+        and_(models.Tombstone.entity_type == entity_type, models.Tombstone.deleted_at >= _with_overlap(since))
+    ).all()
+    return [entity_id for (entity_id,) in result]
 
 # Analytics helper functions
 def get_user_count_by_role(db: Session):
@@ -126,5 +401,10 @@ def get_user_count_by_role(db: Session):
 
 def get_session_count_by_status(db: Session):
     from sqlalchemy import func
-    result = db.query(models.Session.status, func.count(models.Session.id)).group_by(models.Session.status).all()
-    return {status.value: count for status, count in result}
+    # Archived sessions still count towards the totals
+    counts = {}
+    for model in (models.Session, models.ArchivedSession):
+        result = db.query(model.status, func.count(model.id)).group_by(model.status).all()
+        for status, count in result:
+            counts[status.value] = counts.get(status.value, 0) + count
+    return counts
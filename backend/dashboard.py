@@ -0,0 +1,84 @@
+"""
+Role-aware dashboard summary, served by /dashboard/summary in one round trip.
+
+The dashboard used to load with separate calls to /analytics/users,
+/analytics/sessions, /sessions/ and /users/, each one doing its own auth
+lookup and connection checkout. This module runs the same independent queries
+concurrently on a shared thread pool (``DASHBOARD_MAX_WORKERS``). Each query
+gets its own ``SessionLocal`` because a SQLAlchemy session must not be shared
+between threads.
+
+- admins get user and session counts plus the next scheduled sessions;
+- trainers and trainees get their own sessions (hot tier only, as on
+  /sessions/) and the users on the other side of them. Their counts and
+  upcoming sessions are derived from those sessions without another query.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .database import SessionLocal
+from .serialization import SESSION_FIELDS, USER_FIELDS, rows_to_dicts
+
+DASHBOARD_MAX_WORKERS = int(os.getenv("DASHBOARD_MAX_WORKERS", "8"))
+UPCOMING_LIMIT = 10
+
+_executor = ThreadPoolExecutor(max_workers=DASHBOARD_MAX_WORKERS, thread_name_prefix="dashboard")
+
+
+def _with_session(query: Callable[[Session], Any], bind: Optional[Engine]) -> Any:
+    db = SessionLocal(bind=bind) if bind is not None else SessionLocal()
+    try:
+        return query(db)
+    finally:
+        db.close()
+
+
+def _run_concurrently(queries: Dict[str, Callable[[Session], Any]], bind: Optional[Engine]) -> Dict[str, Any]:
+    futures = {name: _executor.submit(_with_session, query, bind) for name, query in queries.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _session_dicts(sessions) -> list:
+    return [{field: getattr(session, field) for field in SESSION_FIELDS} for session in sessions]
+
+
+def build_summary(user: models.User, bind: Optional[Engine] = None) -> Dict[str, Any]:
+    """schemas.DashboardSummary content for user, as plain dicts ready for orjson.
+
+    bind picks the engine the queries run on, e.g. a read replica.
+    """
+    now = datetime.utcnow()
+    if user.role == models.UserRole.admin:
+        results = _run_concurrently({
+            "user_counts": crud.get_user_count_by_role,
+            "session_counts": crud.get_session_count_by_status,
+            "upcoming_sessions": lambda db: rows_to_dicts(
+                SESSION_FIELDS, crud.get_upcoming_session_rows(db, SESSION_FIELDS, now, limit=UPCOMING_LIMIT)
+            ),
+        }, bind)
+        return {"role": user.role, **results}
+
+    get_own_sessions = crud.get_sessions_by_trainer if user.role == models.UserRole.trainer else crud.get_sessions_by_trainee
+    results = _run_concurrently({
+        "sessions": lambda db: _session_dicts(get_own_sessions(db, user.id)),
+        "contacts": lambda db: rows_to_dicts(
+            USER_FIELDS, crud.get_session_partner_rows(db, USER_FIELDS, user.id, user.role)
+        ),
+    }, bind)
+    sessions = results["sessions"]
+    session_counts: Dict[str, int] = {}
+    for session in sessions:
+        session_counts[session["status"].value] = session_counts.get(session["status"].value, 0) + 1
+    upcoming = sorted(
+        (session for session in sessions
+         if session["status"] == models.SessionStatus.scheduled and session["scheduled_date"] >= now),
+        key=lambda session: session["scheduled_date"],
+    )[:UPCOMING_LIMIT]
+    return {"role": user.role, "session_counts": session_counts, "upcoming_sessions": upcoming, **results}
@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from collections import OrderedDict
+from typing import List, Optional
+import itertools
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from fastapi import Request
 import urllib.parse
 
 # Load environment variables from .env file
@@ -17,24 +25,157 @@ DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '3306')
 DB_NAME = os.getenv('DB_NAME', 'training_app')
 
-# Create database if it doesn't exist
-temp_db_url = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/"
-temp_engine = create_engine(temp_db_url, pool_pre_ping=True)
-with temp_engine.connect() as conn:
-    conn.execute(text(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}"))
-    conn.commit()
-temp_engine.dispose()
+# DATABASE_URL overrides the DB_* settings, e.g. sqlite:///bench.db for local benchmarks
+DATABASE_URL = os.getenv('DATABASE_URL')
 
-DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+if not DATABASE_URL:
+    # Create database if it doesn't exist
+    temp_db_url = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/"
+    temp_engine = create_engine(temp_db_url, pool_pre_ping=True)
+    with temp_engine.connect() as conn:
+        conn.execute(text(f"CREATE DATABASE IF NOT EXISTS {DB_NAME}"))
+        conn.commit()
+    temp_engine.dispose()
 
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    echo=True  # Set to False to disable SQL query logging
-)
+    DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+def _create_engine(url: str) -> Engine:
+    return create_engine(
+        url,
+        pool_pre_ping=True,
+        # SQLite connections are shared with FastAPI's threadpool
+        connect_args={"check_same_thread": False} if url.startswith("sqlite") else {},
+        echo=os.getenv('DB_ECHO', '1') == '1'  # Set DB_ECHO=0 to disable SQL query logging
+    )
+
+engine = _create_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read replicas
+#
+# DATABASE_REPLICA_URLS is a comma-separated list of replica URLs. Read-only
+# routes get their session from get_read_db(), which picks a healthy replica
+# (round robin, or least checked-out connections) and falls back to the
+# primary when none is healthy. A client that wrote within the last
+# READ_YOUR_WRITES_SECONDS keeps reading from the primary so it sees its own
+# changes despite replication lag. Clients are told apart by their
+# Authorization header (or address), and recent writers are tracked per
+# worker, so the window should cover the replication lag plus the time a
+# client takes to come back on another worker's connection.
+#
+# Replica health is checked in a background thread every
+# REPLICA_HEALTH_CHECK_SECONDS, and a replica is also taken out of rotation
+# as soon as one of its connections is found dead.
+
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_BALANCING = os.getenv('REPLICA_BALANCING', 'round_robin')  # or least_connections
+REPLICA_HEALTH_CHECK_SECONDS = float(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', '5'))
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+STICKY_MAX_CLIENTS = 100000
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    def __init__(self, primary: Engine, replicas: List[Engine], balancing: str = 'round_robin',
+                 health_check_seconds: float = 5, sticky_seconds: float = 5):
+        self.primary = primary
+        self.replicas = replicas
+        self.balancing = balancing
+        self.health_check_seconds = health_check_seconds
+        self.sticky_seconds = sticky_seconds
+        self._healthy = {id(replica): True for replica in replicas}
+        self._round_robin = itertools.cycle(replicas)
+        self._recent_writers: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._checker: Optional[threading.Thread] = None
+        for replica in replicas:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def _on_error(self, context):
+        if context.is_disconnect and context.engine is not None:
+            self._mark(context.engine, False)
+
+    def _mark(self, replica: Engine, healthy: bool):
+        if self._healthy.get(id(replica)) != healthy:
+            logger.warning("Read replica %s is %s", replica.url.render_as_string(hide_password=True),
+                           "healthy again" if healthy else "down")
+        self._healthy[id(replica)] = healthy
+
+    def check_health(self):
+        for replica in self.replicas:
+            try:
+                with replica.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                self._mark(replica, True)
+            except Exception:
+                self._mark(replica, False)
+
+    def _check_periodically(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_check_seconds)
+
+    def _start_checker(self):
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_periodically, name="replica-health", daemon=True)
+                self._checker.start()
+
+    def record_write(self, client: str):
+        """Pin client's reads to the primary for the read-your-writes window."""
+        if not self.replicas:
+            return
+        with self._lock:
+            self._recent_writers[client] = time.monotonic() + self.sticky_seconds
+            self._recent_writers.move_to_end(client)
+            while len(self._recent_writers) > STICKY_MAX_CLIENTS:
+                self._recent_writers.popitem(last=False)
+
+    def _is_sticky(self, client: Optional[str]) -> bool:
+        if client is None:
+            return False
+        with self._lock:
+            until = self._recent_writers.get(client)
+            if until is None:
+                return False
+            if until < time.monotonic():
+                del self._recent_writers[client]
+                return False
+            return True
+
+    def read_engine(self, client: Optional[str] = None) -> Engine:
+        """Engine to serve a read for client: a healthy replica, or the primary."""
+        if not self.replicas or self._is_sticky(client):
+            return self.primary
+        self._start_checker()
+        healthy = [replica for replica in self.replicas if self._healthy[id(replica)]]
+        if not healthy:
+            return self.primary
+        if self.balancing == 'least_connections':
+            return min(healthy, key=lambda replica: replica.pool.checkedout())
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = next(self._round_robin)
+                if self._healthy[id(replica)]:
+                    return replica
+        return self.primary
+
+
+replica_router = ReplicaRouter(
+    engine,
+    [_create_engine(url) for url in DATABASE_REPLICA_URLS],
+    balancing=REPLICA_BALANCING,
+    health_check_seconds=REPLICA_HEALTH_CHECK_SECONDS,
+    sticky_seconds=READ_YOUR_WRITES_SECONDS,
+)
+
+
+def client_key(request: Request) -> str:
+    """Identifies a client for read-your-writes stickiness."""
+    return request.headers.get("authorization") or (request.client.host if request.client else "")
+
 Base = declarative_base()
 
 # Dependency to get DB session in FastAPI routes
@@ -44,3 +185,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency for read-only routes; served by a replica when one is configured
+def get_read_db(request: Request):
+    db = SessionLocal(bind=replica_router.read_engine(client_key(request)))
+    try:
+        yield db
+    finally:
+        db.close()
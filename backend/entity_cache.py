@@ -0,0 +1,156 @@
+"""
+Read-through cache of serialized users and sessions for /users/{id} and
+/sessions/{id}.
+
+Entries hold the final JSON response bytes and the row's ``updated_at``, so
+a hit skips both the database and Pydantic, and ``If-Modified-Since`` can be
+answered from the entry alone. The cache is an LRU bounded by total bytes
+(``ENTITY_CACHE_MAX_BYTES``).
+
+The ``crud`` update/delete functions invalidate entries in this worker
+directly. Writes made by other workers are picked up through the delta-sync
+helpers (``updated_at`` and tombstones) at most every
+``ENTITY_CACHE_REFRESH_SECONDS``, the same way the user search index does.
+Those helpers look back ``crud.SYNC_OVERLAP_SECONDS`` past the watermark, so
+a write that commits after its timestamp is still seen. Recently changed
+entries may be dropped more than once.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+ENTITY_CACHE_MAX_BYTES = int(os.getenv("ENTITY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+ENTITY_CACHE_REFRESH_SECONDS = float(os.getenv("ENTITY_CACHE_REFRESH_SECONDS", "1"))
+
+# Rough per-entry bookkeeping cost on top of the body
+ENTRY_OVERHEAD_BYTES = 200
+
+Key = Tuple[str, int]
+
+
+class CachedEntity(NamedTuple):
+    body: bytes
+    last_modified: datetime
+
+
+class EntityCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Key, CachedEntity]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Key) -> Optional[CachedEntity]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Key, body: bytes, last_modified: datetime) -> CachedEntity:
+        entry = CachedEntity(body, last_modified)
+        size = len(body) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return entry
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+        return entry
+
+    def _discard(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body) + ENTRY_OVERHEAD_BYTES
+
+    def invalidate(self, kind: str, entity_id: int):
+        with self._lock:
+            self._discard((kind, entity_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def refresh(self, db: Session):
+        """Drop entries changed by other workers since the last refresh."""
+        # Imported here so the cache itself can be used without a database
+        from . import crud
+
+        if time.monotonic() - self._last_refresh < ENTITY_CACHE_REFRESH_SECONDS:
+            return
+        watermark = datetime.utcnow()
+        if self._watermark is None:
+            # Nothing cached yet that could be stale
+            self._watermark, self._last_refresh = watermark, time.monotonic()
+            return
+        for kind, updated_rows in (
+            ("user", crud.get_user_rows_updated_since(db, ["id"], self._watermark)),
+            ("session", crud.get_session_rows_updated_since(db, ["id"], self._watermark)),
+        ):
+            for (entity_id,) in updated_rows:
+                self.invalidate(kind, entity_id)
+            for entity_id in crud.get_deleted_ids_since(db, kind, self._watermark):
+                self.invalidate(kind, entity_id)
+        self._watermark, self._last_refresh = watermark, time.monotonic()
+
+
+cache = EntityCache(ENTITY_CACHE_MAX_BYTES)
+
+
+def get_user(db: Session, user_id: int) -> Optional[CachedEntity]:
+    """Serialized schemas.User for user_id, read through the cache."""
+    from . import crud, serialization
+
+    cache.refresh(db)
+    entry = cache.get(("user", user_id))
+    if entry is not None:
+        return entry
+    rows = crud.get_user_rows_by_ids(db, serialization.USER_FIELDS, [user_id])
+    if not rows:
+        return None
+    row = rows[0]
+    return cache.put(("user", user_id), serialization.dumps(row._asdict()), row.updated_at)
+
+
+def get_session(db: Session, session_id: int) -> Optional[CachedEntity]:
+    """Serialized schemas.Session for session_id (hot or archived), read through the cache."""
+    from . import crud, serialization
+
+    cache.refresh(db)
+    entry = cache.get(("session", session_id))
+    if entry is not None:
+        return entry
+    row = crud.get_session_row(db, serialization.SESSION_FIELDS, session_id)
+    if row is None:
+        return None
+    return cache.put(("session", session_id), serialization.dumps(row._asdict()), row.updated_at)
@@ -0,0 +1,221 @@
+"""
+Bulk import of users and sessions from CSV or XLSX uploads.
+
+Files are read row by row: CSV through the ``csv`` module and XLSX through
+openpyxl in read-only mode. Only one batch of ``IMPORT_BATCH_SIZE`` rows is
+held at a time, and only the first ``IMPORT_MAX_REPORTED_ERRORS`` row errors
+are kept, so memory does not grow with the file. The first row holds the
+column names, which are the ``schemas.UserCreate``/``SessionCreate`` field
+names (case and spaces are ignored, so "First Name" works). Empty cells fall
+back to the schema defaults.
+
+Each row is validated against its schema. Each batch is then checked against
+the database in a few set-based queries: duplicate usernames/emails for
+users; unknown users and double-bookings for sessions. Bookings are checked
+against one calendar query per batch and against earlier rows of the file. The batch's valid rows go in with one multi-row INSERT and
+their own commit. Invalid rows are reported with their spreadsheet row number
+and do not stop the import.
+
+Password hashing is deliberately slow and dominates user imports. It runs on
+a thread pool (``IMPORT_HASH_WORKERS``, default one per CPU), because
+hashlib's pbkdf2 releases the GIL.
+
+Imported rows get fresh ``updated_at`` values, so delta-sync clients, the
+user search index and other workers' caches pick them up like any other
+write. No per-row WebSocket events are broadcast.
+"""
+
+import csv
+import io
+import os
+from bisect import insort
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from openpyxl import load_workbook
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import crud, models, recurrence, scheduling, schemas
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 4)))
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+_hash_executor = ThreadPoolExecutor(max_workers=IMPORT_HASH_WORKERS, thread_name_prefix="import-hash")
+
+Row = Tuple[int, Dict[str, Any]]  # spreadsheet row number, values by field name
+
+
+class UnsupportedFile(Exception):
+    """Raised for uploads that are not .csv or .xlsx."""
+
+
+def _field_name(header) -> str:
+    return str(header or "").strip().lower().replace(" ", "_")
+
+
+def _row_values(headers: List[str], values: Iterable[Any]) -> Dict[str, Any]:
+    return {
+        header: value for header, value in zip(headers, values)
+        if header and value is not None and value != ""
+    }
+
+
+def iter_rows(file, filename: str) -> Iterator[Row]:
+    """Yield (row number, {field: value}) for each data row of a CSV or XLSX file."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        try:
+            reader = csv.reader(text)
+            headers = [_field_name(header) for header in next(reader, [])]
+            for number, values in enumerate(reader, start=2):
+                if any(values):
+                    yield number, _row_values(headers, values)
+        finally:
+            # Leave the upload's file open for its owner
+            text.detach()
+    elif extension == ".xlsx":
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            headers = [_field_name(header) for header in next(rows, ())]
+            for number, values in enumerate(rows, start=2):
+                if any(value is not None for value in values):
+                    yield number, _row_values(headers, values)
+        finally:
+            workbook.close()
+    else:
+        raise UnsupportedFile(extension)
+
+
+def _batches(rows: Iterator[Row], size: int) -> Iterator[List[Row]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _fail(result: schemas.ImportResult, number: int, errors: List[str]):
+    result.failed += 1
+    if len(result.errors) < IMPORT_MAX_REPORTED_ERRORS:
+        result.errors.append(schemas.ImportRowError(row=number, errors=errors))
+
+
+def _validate(result: schemas.ImportResult, schema, batch: List[Row]) -> List[Tuple[int, Any]]:
+    valid = []
+    for number, values in batch:
+        try:
+            valid.append((number, schema.model_validate(values)))
+        except ValidationError as error:
+            _fail(result, number, [
+                f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" for detail in error.errors()
+            ])
+    return valid
+
+
+def import_users(db: Session, file, filename: str) -> schemas.ImportResult:
+    result = schemas.ImportResult()
+    for batch in _batches(iter_rows(file, filename), IMPORT_BATCH_SIZE):
+        candidates = _validate(result, schemas.UserCreate, batch)
+        usernames = {user.username for _, user in candidates}
+        emails = {user.email for _, user in candidates}
+        taken_usernames = {username for (username,) in db.query(models.User.username).filter(models.User.username.in_(usernames))}
+        taken_emails = {email for (email,) in db.query(models.User.email).filter(models.User.email.in_(emails))}
+
+        accepted = []
+        for number, user in candidates:
+            errors = []
+            if user.username in taken_usernames:
+                errors.append("username: already registered")
+            if user.email in taken_emails:
+                errors.append("email: already registered")
+            if errors:
+                _fail(result, number, errors)
+                continue
+            # Later rows with the same username/email are duplicates of this one
+            taken_usernames.add(user.username)
+            taken_emails.add(user.email)
+            accepted.append(user)
+        if not accepted:
+            continue
+
+        password_hashes = _hash_executor.map(crud.pwd_context.hash, [user.password for user in accepted])
+        now = datetime.utcnow()
+        db.execute(models.User.__table__.insert(), [
+            {"username": user.username, "email": user.email, "password_hash": password_hash,
+             "role": models.UserRole(user.role.value), "first_name": user.first_name, "last_name": user.last_name,
+             "is_temporary_password": user.is_temporary_password, "created_at": now, "updated_at": now}
+            for user, password_hash in zip(accepted, password_hashes)
+        ])
+        db.commit()
+        result.inserted += len(accepted)
+    return result
+
+
+def import_sessions(db: Session, file, filename: str) -> schemas.ImportResult:
+    result = schemas.ImportResult()
+    for batch in _batches(iter_rows(file, filename), IMPORT_BATCH_SIZE):
+        candidates = _validate(result, schemas.SessionCreate, batch)
+        user_ids = {session.trainer_id for _, session in candidates} | {session.trainee_id for _, session in candidates}
+        known_ids = {user_id for (user_id,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))}
+
+        for _, session in candidates:
+            session.scheduled_date = scheduling.naive_utc(session.scheduled_date)
+        scheduled = [session for _, session in candidates if session.status == schemas.SessionStatus.scheduled]
+        # One query for the calendars of everyone booked in this batch; rows
+        # accepted below are added to them, so rows are checked against each other too
+        busy = {}
+        if scheduled:
+            booked_ids = {user_id for session in scheduled for user_id in (session.trainer_id, session.trainee_id)}
+            # Held until the batch commits, like scheduling.check_session
+            scheduling.lock_users(db, booked_ids)
+            window_start = min(session.scheduled_date for session in scheduled)
+            window_end = max(session.scheduled_date + timedelta(minutes=session.duration_minutes) for session in scheduled)
+            busy = scheduling.busy_by_user(db, booked_ids, window_start, window_end)
+            # Unstored series occurrences are bookings too
+            for occurrence in recurrence.occurrences_overlapping(db, list(booked_ids), window_start, window_end):
+                start = occurrence["scheduled_date"]
+                interval = (start, start + timedelta(minutes=occurrence["duration_minutes"]),
+                            f"series {occurrence['series_id']} occurrence {start.isoformat()}")
+                for user_id in {occurrence["trainer_id"], occurrence["trainee_id"]} & booked_ids:
+                    insort(busy[user_id], interval)
+
+        accepted = []
+        for number, session in candidates:
+            missing = [f"{field}: user {user_id} not found"
+                       for field, user_id in (("trainer_id", session.trainer_id), ("trainee_id", session.trainee_id))
+                       if user_id not in known_ids]
+            if missing:
+                _fail(result, number, missing)
+                continue
+            if session.status == schemas.SessionStatus.scheduled:
+                participants = (session.trainer_id, session.trainee_id)
+                start = session.scheduled_date
+                end = start + timedelta(minutes=session.duration_minutes)
+                overlap = next(filter(None, (scheduling.first_overlap(busy[user_id], start, end) for user_id in participants)), None)
+                if overlap is not None:
+                    _fail(result, number, [f"schedule: trainer or trainee is already booked ({overlap})"])
+                    continue
+                for user_id in participants:
+                    insort(busy[user_id], (start, end, f"row {number}"))
+            accepted.append(session)
+        if not accepted:
+            db.rollback()  # release the user locks
+            continue
+
+        now = datetime.utcnow()
+        db.execute(models.Session.__table__.insert(), [
+            {**session.model_dump(exclude={"status"}), "status": models.SessionStatus(session.status.value),
+             "created_at": now, "updated_at": now}
+            for session in accepted
+        ])
+        db.commit()
+        result.inserted += len(accepted)
+    return result
@@ -1,27 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, UploadFile, status, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import math
 import jwt
 import json
 import io
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 import sys
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from . import models, schemas, crud, reporting
-from .database import engine, get_db, SessionLocal
+from . import models, schemas, crud, reporting, query_diagnostics, serialization, conditional, scheduling, search, ratelimit, archiving, entity_cache, dashboard, profiling, importing, recurrence, realtime
+from .database import engine, get_db, get_read_db, client_key, replica_router, SessionLocal
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Training Management API", version="1.0.0")
 
+# Build the in-memory user search index in the background, before the first search
+@app.on_event("startup")
+def warm_search_index():
+    if search.SEARCH_INDEX == "memory":
+        search.user_index.warm()
+
 # CORS middleware for frontend integration
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +39,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Read-your-writes: after a successful write, keep the client on the primary for a while
+if replica_router.replicas:
+    async def track_writes(request: Request, call_next):
+        response = await call_next(request)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+            replica_router.record_write(client_key(request))
+        return response
+
+    app.middleware("http")(track_writes)
+
+# Opt-in slow query / N+1 logging (QUERY_DIAGNOSTICS=1)
+if query_diagnostics.ENABLED:
+    app.middleware("http")(query_diagnostics.diagnostics_middleware)
+
 # JWT configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
@@ -38,26 +60,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 security = HTTPBearer()
 
-# WebSocket connection manager for real-time updates
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                self.disconnect(connection)
-
-manager = ConnectionManager()
+# WebSocket connections for real-time updates (see realtime.py)
+manager = realtime.manager
 
 # Authentication functions
 def create_access_token(data: dict):
@@ -85,10 +89,21 @@ def get_current_user(db: Session = Depends(get_db), username: str = Depends(veri
 
 # Authentication routes
 @app.post("/auth/login", response_model=schemas.TokenResponse)
-def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
+def login(login_data: schemas.LoginRequest, request: Request, db: Session = Depends(get_db)):
+    # Throttle before any password hashing or DB work
+    client_ip = request.client.host if request.client else "unknown"
+    retry_after = ratelimit.login_throttle.check(client_ip, login_data.username)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
     user = crud.authenticate_user(db, login_data.username, login_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    ratelimit.login_throttle.succeeded(client_ip, login_data.username)
 
     access_token = create_access_token(data={"sub": user.username})
     return {
@@ -100,20 +115,49 @@ def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
 
 # User routes
 @app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def read_users(request: Request, skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role not in ["admin", "trainer"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    users = crud.get_users(db, skip=skip, limit=limit)
-    return users
+    etag = conditional.table_etag(db, models.User, extra=f"{skip}:{limit}")
+    matched = conditional.etag_matches(request, etag)
+    if matched:
+        return conditional.not_modified(etag=matched, vary="Accept-Encoding")
+    # Column tuples encoded straight to JSON; same fields as schemas.User
+    rows = crud.get_user_rows(db, serialization.USER_FIELDS, skip=skip, limit=limit)
+    return serialization.json_response(
+        request,
+        serialization.rows_to_dicts(serialization.USER_FIELDS, rows),
+        headers=conditional.validator_headers(etag=etag),
+    )
+
+@app.get("/users/search", response_model=List[schemas.User])
+def search_users(request: Request, q: str, role: Optional[schemas.UserRole] = None, limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "trainer"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if search.SEARCH_INDEX == "memory":
+        search.user_index.refresh(db)
+    if search.user_index.ready:
+        user_ids = search.user_index.search(q, role=role, limit=limit)
+    else:
+        # Index disabled, or still being built
+        user_ids = search.database_search(db, q, role=role, limit=limit)
+    if not user_ids:
+        return serialization.json_response(request, [])
+    rows = {row.id: row for row in crud.get_user_rows_by_ids(db, serialization.USER_FIELDS, user_ids)}
+    ranked = [rows[user_id] for user_id in user_ids if user_id in rows]
+    return serialization.json_response(request, serialization.rows_to_dicts(serialization.USER_FIELDS, ranked))
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def read_user(user_id: int, request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role not in ["admin", "trainer"] and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
-    user = crud.get_user(db, user_id=user_id)
+    user = entity_cache.get_user(db, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    if conditional.not_modified_since(request, user.last_modified):
+        return conditional.not_modified(last_modified=user.last_modified)
+    # Cached schemas.User JSON, sent as is
+    return Response(content=user.body, media_type="application/json", headers=conditional.validator_headers(last_modified=user.last_modified))
 
 @app.post("/users/", response_model=schemas.User)
 async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
@@ -129,35 +173,38 @@ async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), c
     created_user = crud.create_user(db, user)
 
     # Broadcast user creation event
-    await manager.broadcast({
-        "type": "user_created",
-        "data": {
-            "user_id": created_user.id,
-            "action": "created",
-            "user": created_user.__dict__
-        }
-    })
+    await manager.broadcast("user_created", schemas.UserUpdateEvent(
+        user_id=created_user.id,
+        action="created",
+        user=schemas.User.model_validate(created_user),
+    ))
 
     return created_user
 
+def version_conflict_error(conflict: crud.VersionConflict):
+    return HTTPException(status_code=409, detail={
+        "message": "Modified by someone else since it was read",
+        "current_version": conflict.current_version,
+    })
+
 @app.put("/users/{user_id}", response_model=schemas.User)
 async def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin" and current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    updated_user = crud.update_user(db, user_id, user_update)
+    try:
+        updated_user = crud.update_user(db, user_id, user_update)
+    except crud.VersionConflict as conflict:
+        raise version_conflict_error(conflict)
     if updated_user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Broadcast user update event
-    await manager.broadcast({
-        "type": "user_updated",
-        "data": {
-            "user_id": user_id,
-            "action": "updated",
-            "user": updated_user.__dict__
-        }
-    })
+    await manager.broadcast("user_updated", schemas.UserUpdateEvent(
+        user_id=user_id,
+        action="updated",
+        user=schemas.User.model_validate(updated_user),
+    ))
 
     return updated_user
 
@@ -171,45 +218,62 @@ async def delete_user(user_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Broadcast user deletion event
-    await manager.broadcast({
-        "type": "user_deleted",
-        "data": {
-            "user_id": user_id,
-            "action": "deleted"
-        }
-    })
+    await manager.broadcast("user_deleted", schemas.UserUpdateEvent(user_id=user_id, action="deleted"))
 
     return {"message": "User deleted successfully"}
 
 # Session routes
+def schedule_conflict_error(conflict: scheduling.ScheduleConflict):
+    return HTTPException(status_code=409, detail={
+        "message": "Trainer or trainee is already booked at that time",
+        "conflicting_session_ids": conflict.conflicting_session_ids,
+        "conflicting_occurrences": [
+            {"series_id": series_id, "occurrence_start": occurrence_start.isoformat()}
+            for series_id, occurrence_start in conflict.conflicting_occurrences
+        ],
+    })
+
 @app.get("/sessions/", response_model=List[schemas.Session])
-def read_sessions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    sessions = crud.get_sessions(db, skip=skip, limit=limit)
-    return sessions
+def read_sessions(request: Request, skip: int = 0, limit: int = 100, include_archived: bool = False, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    tables = (models.Session, models.ArchivedSession) if include_archived else (models.Session,)
+    etag = conditional.table_etag(db, *tables, extra=f"{skip}:{limit}")
+    matched = conditional.etag_matches(request, etag)
+    if matched:
+        return conditional.not_modified(etag=matched, vary="Accept-Encoding")
+    # Column tuples encoded straight to JSON; same fields as schemas.Session
+    rows = crud.get_session_rows(db, serialization.SESSION_FIELDS, skip=skip, limit=limit, include_archived=include_archived)
+    return serialization.json_response(
+        request,
+        serialization.rows_to_dicts(serialization.SESSION_FIELDS, rows),
+        headers=conditional.validator_headers(etag=etag),
+    )
 
 @app.get("/sessions/{session_id}", response_model=schemas.Session)
-def read_session(session_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    session = crud.get_session(db, session_id=session_id)
+def read_session(session_id: int, request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    session = entity_cache.get_session(db, session_id)
     if session is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    return session
+    if conditional.not_modified_since(request, session.last_modified):
+        return conditional.not_modified(last_modified=session.last_modified)
+    # Cached schemas.Session JSON, sent as is
+    return Response(content=session.body, media_type="application/json", headers=conditional.validator_headers(last_modified=session.last_modified))
 
 @app.post("/sessions/", response_model=schemas.Session)
 async def create_session(session: schemas.SessionCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role not in ["admin", "trainer"]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    created_session = crud.create_session(db, session)
+    try:
+        created_session = crud.create_session(db, session)
+    except scheduling.ScheduleConflict as conflict:
+        raise schedule_conflict_error(conflict)
 
     # Broadcast session creation event
-    await manager.broadcast({
-        "type": "session_created",
-        "data": {
-            "session_id": created_session.id,
-            "status": created_session.status.value,
-            "updated_at": created_session.updated_at.isoformat()
-        }
-    })
+    await manager.broadcast("session_created", schemas.SessionUpdateEvent(
+        session_id=created_session.id,
+        status=created_session.status,
+        updated_at=created_session.updated_at,
+    ))
 
     return created_session
 
@@ -218,19 +282,21 @@ async def update_session(session_id: int, session_update: schemas.SessionUpdate,
     if current_user.role not in ["admin", "trainer"]:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    updated_session = crud.update_session(db, session_id, session_update)
+    try:
+        updated_session = crud.update_session(db, session_id, session_update)
+    except scheduling.ScheduleConflict as conflict:
+        raise schedule_conflict_error(conflict)
+    except crud.VersionConflict as conflict:
+        raise version_conflict_error(conflict)
     if updated_session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
     # Broadcast session update event
-    await manager.broadcast({
-        "type": "session_updated",
-        "data": {
-            "session_id": session_id,
-            "status": updated_session.status.value,
-            "updated_at": updated_session.updated_at.isoformat()
-        }
-    })
+    await manager.broadcast("session_updated", schemas.SessionUpdateEvent(
+        session_id=session_id,
+        status=updated_session.status,
+        updated_at=updated_session.updated_at,
+    ))
 
     return updated_session
 
@@ -244,36 +310,249 @@ async def delete_session(session_id: int, db: Session = Depends(get_db), current
         raise HTTPException(status_code=404, detail="Session not found")
 
     # Broadcast session deletion event
-    await manager.broadcast({
-        "type": "session_deleted",
-        "data": {
-            "session_id": session_id
-        }
-    })
+    await manager.broadcast("session_deleted", schemas.SessionUpdateEvent(session_id=session_id))
 
     return {"message": "Session deleted successfully"}
 
+# Recurring series routes
+def unknown_users_error(error: crud.UnknownUsers):
+    return HTTPException(status_code=400, detail={"message": "Unknown trainer or trainee", "user_ids": error.user_ids})
+
+@app.post("/series/", response_model=schemas.SessionSeries)
+def create_series(series: schemas.SessionSeriesCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "trainer"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        return crud.create_series(db, series)
+    except crud.UnknownUsers as error:
+        raise unknown_users_error(error)
+    except scheduling.ScheduleConflict as conflict:
+        raise schedule_conflict_error(conflict)
+
+@app.get("/series/{series_id}", response_model=schemas.SessionSeries)
+def read_series(series_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    series = crud.get_series(db, series_id)
+    if series is None:
+        raise HTTPException(status_code=404, detail="Series not found")
+    return series
+
+@app.put("/series/{series_id}", response_model=schemas.SessionSeries)
+def update_series(series_id: int, series_update: schemas.SessionSeriesUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "trainer"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        updated_series = crud.update_series(db, series_id, series_update)
+    except crud.VersionConflict as conflict:
+        raise version_conflict_error(conflict)
+    except crud.UnknownUsers as error:
+        raise unknown_users_error(error)
+    except scheduling.ScheduleConflict as conflict:
+        raise schedule_conflict_error(conflict)
+    if updated_series is None:
+        raise HTTPException(status_code=404, detail="Series not found")
+    return updated_series
+
+@app.delete("/series/{series_id}")
+def delete_series(series_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can delete series")
+    if not crud.delete_series(db, series_id):
+        raise HTTPException(status_code=404, detail="Series not found")
+    return {"message": "Series deleted successfully"}
+
+@app.put("/series/{series_id}/occurrences/{occurrence_start}", response_model=schemas.Session)
+async def update_occurrence(series_id: int, occurrence_start: datetime, session_update: schemas.SessionUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "trainer"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    # Stores the occurrence as a session on its first change
+    try:
+        session = crud.update_occurrence(db, series_id, occurrence_start, session_update)
+    except recurrence.NotAnOccurrence:
+        raise HTTPException(status_code=404, detail="Not an occurrence of this series")
+    except crud.UnknownUsers as error:
+        raise unknown_users_error(error)
+    except scheduling.ScheduleConflict as conflict:
+        raise schedule_conflict_error(conflict)
+    except crud.VersionConflict as conflict:
+        raise version_conflict_error(conflict)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Series or session not found")
+
+    await manager.broadcast("session_updated", schemas.SessionUpdateEvent(
+        session_id=session.id,
+        status=session.status,
+        updated_at=session.updated_at,
+    ))
+
+    return session
+
+@app.delete("/series/{series_id}/occurrences/{occurrence_start}")
+def skip_occurrence(series_id: int, occurrence_start: datetime, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "trainer"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        skipped = crud.skip_occurrence(db, series_id, occurrence_start)
+    except recurrence.NotAnOccurrence:
+        raise HTTPException(status_code=404, detail="Not an occurrence of this series")
+    if not skipped:
+        raise HTTPException(status_code=404, detail="Series not found")
+    return {"message": "Occurrence skipped"}
+
+@app.get("/calendar", response_model=List[schemas.Occurrence])
+def read_calendar(request: Request, start: datetime, end: datetime, user_id: Optional[int] = None, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    # Trainees only see their own calendar
+    if current_user.role == "trainee":
+        user_id = current_user.id
+    try:
+        entries = recurrence.calendar(db, start, end, user_id)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return serialization.json_response(request, entries)
+
+# Bulk import
+def _run_import(import_rows, db: Session, file: UploadFile) -> schemas.ImportResult:
+    try:
+        return import_rows(db, file.file, file.filename)
+    except importing.UnsupportedFile:
+        raise HTTPException(status_code=400, detail="Upload a .csv or .xlsx file")
+
+@app.post("/import/users", response_model=schemas.ImportResult)
+def import_users(file: UploadFile = File(...), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can create users")
+    return _run_import(importing.import_users, db, file)
+
+@app.post("/import/sessions", response_model=schemas.ImportResult)
+def import_sessions(file: UploadFile = File(...), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "trainer"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return _run_import(importing.import_sessions, db, file)
+
+@app.post("/sessions/archive")
+def archive_sessions(horizon_days: Optional[int] = Query(None, ge=0), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can archive sessions")
+    archived = archiving.archive_sessions(db, horizon_days=horizon_days)
+    return {"archived": archived, "tombstones_pruned": crud.prune_tombstones(db)}
+
+# Scheduling routes
+@app.get("/schedule/free-slots", response_model=List[schemas.TimeSlot])
+def read_free_slots(start: datetime, end: datetime, duration_minutes: int, user_ids: List[int] = Query(...), db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
+    if end <= start or duration_minutes <= 0:
+        raise HTTPException(status_code=400, detail="Need start < end and a positive duration")
+    slots = scheduling.find_free_slots(db, user_ids, start, end, duration_minutes)
+    return [{"start": slot_start, "end": slot_end} for slot_start, slot_end in slots]
+
+# Delta sync route
+@app.get("/sync/changes", response_model=schemas.ChangesResponse)
+def read_changes(since: datetime, request: Request, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    # Timestamps are stored as naive UTC
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    # Taken before querying. The change queries also look back SYNC_OVERLAP_SECONDS
+    # past since, for writes that committed late, so clients may see a row twice
+    watermark = datetime.utcnow()
+    if since < watermark - timedelta(days=crud.TOMBSTONE_RETENTION_DAYS):
+        # Tombstones older than the retention window are gone; reload everything
+        return serialization.json_response(request, schemas.ChangesResponse(watermark=watermark, full_resync_required=True).model_dump())
+
+    changes = {
+        "watermark": watermark,
+        "full_resync_required": False,
+        "sessions": serialization.rows_to_dicts(
+            serialization.SESSION_FIELDS,
+            crud.get_session_rows_updated_since(db, serialization.SESSION_FIELDS, since),
+        ),
+        "deleted_session_ids": crud.get_deleted_ids_since(db, "session", since),
+        "users": [],
+        "deleted_user_ids": [],
+    }
+    if current_user.role in ["admin", "trainer"]:
+        changes["users"] = serialization.rows_to_dicts(
+            serialization.USER_FIELDS,
+            crud.get_user_rows_updated_since(db, serialization.USER_FIELDS, since),
+        )
+        changes["deleted_user_ids"] = crud.get_deleted_ids_since(db, "user", since)
+    return serialization.json_response(request, changes)
+
+# Dashboard
+@app.get("/dashboard/summary", response_model=schemas.DashboardSummary)
+def read_dashboard_summary(request: Request, current_user: models.User = Depends(get_current_user)):
+    # Replaces the dashboard's separate analytics, users and sessions calls
+    bind = replica_router.read_engine(client_key(request))
+    return serialization.json_response(request, dashboard.build_summary(current_user, bind=bind))
+
+# Diagnostics
+@app.get("/diagnostics/profile")
+def profile_worker(seconds: float = Query(10, gt=0), interval_ms: float = Query(10, ge=1), memory: bool = False, format: str = "json", current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        result = profiling.profile(seconds, interval_ms=interval_ms, memory=memory)
+    except profiling.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running in this worker")
+    if format == "collapsed":
+        # Input for flamegraph.pl or speedscope
+        return Response(content=profiling.collapsed_text(result["stacks"]), media_type="text/plain")
+    return result
+
 # Analytics routes
 @app.get("/analytics/users")
-def get_user_analytics(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_user_analytics(request: Request, response: Response, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
+    etag = conditional.table_etag(db, models.User)
+    matched = conditional.etag_matches(request, etag)
+    if matched:
+        return conditional.not_modified(etag=matched)
+    response.headers.update(conditional.validator_headers(etag=etag))
     return crud.get_user_count_by_role(db)
 
 @app.get("/analytics/sessions")
-def get_session_analytics(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_session_analytics(request: Request, response: Response, start: Optional[datetime] = None, end: Optional[datetime] = None, db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
-    return crud.get_session_count_by_status(db)
+    # With a window, sessions starting in it plus the series occurrences expanded into it
+    windowed = start is not None and end is not None
+    tables = (models.Session, models.ArchivedSession)
+    if windowed:
+        tables += (models.SessionSeries, models.SeriesException)
+    etag = conditional.table_etag(db, *tables, extra=f"{start}:{end}" if windowed else "")
+    matched = conditional.etag_matches(request, etag)
+    if matched:
+        return conditional.not_modified(etag=matched)
+    response.headers.update(conditional.validator_headers(etag=etag))
+    if not windowed:
+        return crud.get_session_count_by_status(db)
+    try:
+        return recurrence.count_by_status(db, start, end)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+@app.get("/analytics/cache")
+def get_cache_analytics(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    # Per worker: hits, misses and hit ratio of the /users/{id} and /sessions/{id} cache
+    return entity_cache.cache.stats()
+
+@app.get("/analytics/websockets")
+def get_websocket_analytics(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    # Per worker: live connections and how closed ones ended (disconnected, timed_out, evicted, send_failed)
+    return manager.stats()
 
 # Report generation endpoint
 @app.get("/reports/generate")
-def generate_report(format: str = "pdf", db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def generate_report(format: str = "pdf", db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    users = crud.get_users(db)
-    sessions = crud.get_sessions(db)
+    # Reports cover everything: no page limit, and both session tiers
+    users = crud.get_users(db, limit=None)
+    sessions = crud.get_sessions(db, limit=None, include_archived=True)
 
     if format == "csv":
         report_data = reporting.generate_csv_report(users, sessions)
@@ -300,15 +579,45 @@ def generate_report(format: str = "pdf", db: Session = Depends(get_db), current_
         raise HTTPException(status_code=400, detail="Unsupported format. Use 'pdf', 'excel', or 'csv'")
 
 # WebSocket endpoint for real-time updates
+def _websocket_token(websocket: WebSocket) -> Optional[str]:
+    # Browsers cannot set an Authorization header on a WebSocket. The token is
+    # offered as a subprotocol, new WebSocket(url, ["access_token", token]), which
+    # keeps it out of the URL and so out of access logs.
+    subprotocols = websocket.scope.get("subprotocols", [])
+    if len(subprotocols) == 2 and subprotocols[0] == realtime.TOKEN_SUBPROTOCOL:
+        return subprotocols[1]
+    return None
+
+def _websocket_user_id(token: Optional[str]) -> Optional[int]:
+    try:
+        username = jwt.decode(token or "", SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except jwt.PyJWTError:
+        return None
+    db = SessionLocal()
+    try:
+        user = crud.get_user_by_username(db, username) if username else None
+        return user.id if user else None
+    finally:
+        db.close()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    user_id = await run_in_threadpool(_websocket_user_id, _websocket_token(websocket))
+    if user_id is None:
+        await websocket.close(code=realtime.CLOSE_POLICY_VIOLATION)
+        return
+    if not await manager.connect(websocket, user_id):
+        return
     try:
+        # Clients only send pongs; every frame counts as a heartbeat
         while True:
-            data = await websocket.receive_text()
-            # Echo back for testing, or handle client messages
-            await websocket.send_text(f"Message received: {data}")
-    except WebSocketDisconnect:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            manager.received(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        pass  # closed by the server, e.g. reaped
+    finally:
         manager.disconnect(websocket)
 
 # Root endpoint
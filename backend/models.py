@@ -1,20 +1,24 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Boolean, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from enum import Enum as PyEnum
 
 from .database import Base
 
-class UserRole(PyEnum):
+class UserRole(str, PyEnum):
     admin = "admin"
     trainer = "trainer"
     trainee = "trainee"
 
-class SessionStatus(PyEnum):
+class SessionStatus(str, PyEnum):
     scheduled = "scheduled"
     completed = "completed"
     cancelled = "cancelled"
 
+class RecurrenceFrequency(str, PyEnum):
+    daily = "daily"
+    weekly = "weekly"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -27,7 +31,9 @@ class User(Base):
     last_name = Column(String(50), nullable=False)
     is_temporary_password = Column(Boolean, default=True, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Bumped by every update; optimistic concurrency check in crud.update_user
+    version = Column(Integer, default=1, server_default="1", nullable=False)
 
     # Relationships
     sessions_as_trainer = relationship("Session", back_populates="trainer", foreign_keys="Session.trainer_id")
@@ -45,8 +51,82 @@ class Session(Base):
     duration_minutes = Column(Integer, nullable=False)
     status = Column(Enum(SessionStatus), default=SessionStatus.scheduled)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # Bumped by every update; optimistic concurrency check in crud.update_session
+    version = Column(Integer, default=1, server_default="1", nullable=False)
 
     # Relationships
     trainer = relationship("User", back_populates="sessions_as_trainer", foreign_keys=[trainer_id])
     trainee = relationship("User", back_populates="sessions_as_trainee", foreign_keys=[trainee_id])
+
+    # Range scans for schedule conflict detection and the dashboard's upcoming sessions
+    __table_args__ = (
+        Index("ix_sessions_trainer_schedule", "trainer_id", "scheduled_date"),
+        Index("ix_sessions_trainee_schedule", "trainee_id", "scheduled_date"),
+        Index("ix_sessions_status_schedule", "status", "scheduled_date"),
+        # IDs of archived and deleted sessions must not be handed out again
+        {"sqlite_autoincrement": True},
+    )
+
+class ArchivedSession(Base):
+    """Completed/cancelled sessions moved out of the hot sessions table by archiving.py."""
+    __tablename__ = "sessions_archive"
+
+    # Same IDs as in sessions; no foreign keys so history survives user deletion
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String(100), nullable=False)
+    description = Column(String(500))
+    trainer_id = Column(Integer, nullable=False, index=True)
+    trainee_id = Column(Integer, nullable=False, index=True)
+    scheduled_date = Column(DateTime, nullable=False, index=True)
+    duration_minutes = Column(Integer, nullable=False)
+    status = Column(Enum(SessionStatus), nullable=False)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime, index=True)
+    version = Column(Integer, server_default="1", nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class Tombstone(Base):
+    """Deleted user/session IDs, kept so clients can sync deletions they missed."""
+    __tablename__ = "tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity_type = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class SessionSeries(Base):
+    """A recurring session; occurrences are expanded from the rule by recurrence.py, not stored."""
+    __tablename__ = "session_series"
+
+    id = Column(Integer, primary_key=True, index=True)
+    title = Column(String(100), nullable=False)
+    description = Column(String(500))
+    trainer_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    trainee_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # Rule: starts_at + k * repeat_every days/weeks, up to occurrence_count and/or until
+    starts_at = Column(DateTime, nullable=False)
+    duration_minutes = Column(Integer, nullable=False)
+    frequency = Column(Enum(RecurrenceFrequency), nullable=False, default=RecurrenceFrequency.weekly)
+    repeat_every = Column(Integer, nullable=False, default=1)
+    until = Column(DateTime)
+    occurrence_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+
+class SeriesException(Base):
+    """An occurrence of a series that was skipped, or stored as a sessions row (session_id)."""
+    __tablename__ = "session_series_exceptions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    series_id = Column(Integer, ForeignKey("session_series.id"), nullable=False)
+    occurrence_start = Column(DateTime, nullable=False)  # the slot given by the rule
+    # No foreign key: the session may be archived or deleted, and the slot stays taken
+    session_id = Column(Integer, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("series_id", "occurrence_start", name="uq_series_exceptions_occurrence"),
+    )
@@ -0,0 +1,140 @@
+"""
+On-demand statistical profiler for a running worker.
+
+``profile()`` samples the stacks of every thread in the process with
+``sys._current_frames()`` for a fixed duration and aggregates them into
+collapsed stacks, the ``frame;frame;frame count`` text accepted by
+flamegraph.pl and speedscope. Only the worker that serves the request is
+profiled.
+
+Overhead is capped. The sampler thread holds the GIL while it walks stacks,
+so its CPU time is its whole cost to the application. After each sample the
+interval is stretched so that this CPU time stays under
+``PROFILE_MAX_OVERHEAD`` of wall time (default 2%). Runs are limited to
+``PROFILE_MAX_SECONDS``, and only one runs at a time per worker.
+
+With ``memory=True``, tracemalloc also records allocations during the run and
+returns the top allocation sites. Tracing slows allocation-heavy code down
+noticeably and is not covered by the overhead cap; only the duration limit
+applies. If tracemalloc was already running, it is left running.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_MAX_OVERHEAD = float(os.getenv("PROFILE_MAX_OVERHEAD", "0.02"))
+MIN_INTERVAL_SECONDS = 0.001
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 30
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is already running in this worker."""
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename.replace(os.sep, "/")
+    short_path = "/".join(path.rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({short_path}:{code.co_firstlineno})"
+
+
+def _collapsed_stack(thread_name: str, frame, label_cache: dict) -> str:
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        label = label_cache.get(code)
+        if label is None:
+            label = label_cache[code] = _frame_label(code)
+        labels.append(label)
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+def collapsed_text(stacks: Dict[str, int]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def _sample(seconds: float, interval: float) -> dict:
+    sampler_id = threading.get_ident()
+    stacks: Counter = Counter()
+    label_cache: dict = {}
+    samples = 0
+    sampling_time = 0.0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        if time.perf_counter() >= deadline:
+            break
+        cpu_before = time.thread_time()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != sampler_id:
+                stacks[_collapsed_stack(names.get(thread_id, str(thread_id)), frame, label_cache)] += 1
+        frame = None  # do not keep the last sampled frame alive
+        samples += 1
+        cost = time.thread_time() - cpu_before
+        sampling_time += cost
+        # Stretch the interval until the sampler's CPU time fits the overhead budget
+        interval = max(interval, cost / PROFILE_MAX_OVERHEAD)
+        time.sleep(max(0.0, min(interval - cost, deadline - time.perf_counter())))
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 3),
+        "samples": samples,
+        "final_interval_ms": round(interval * 1000, 3),
+        "overhead": round(sampling_time / elapsed, 4) if elapsed else 0.0,
+        "stacks": dict(stacks),
+    }
+
+
+def _top_allocations(snapshot: tracemalloc.Snapshot) -> List[dict]:
+    stats = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ]).statistics("traceback")
+    return [
+        {
+            "size_bytes": stat.size,
+            "count": stat.count,
+            "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        }
+        for stat in stats[:TOP_ALLOCATIONS]
+    ]
+
+
+def profile(seconds: float, interval_ms: float = 10, memory: bool = False) -> dict:
+    """Sample this worker for seconds (capped) and return collapsed stacks and stats."""
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy()
+    started_tracing = False
+    try:
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            started_tracing = True
+        result: Optional[dict] = None
+
+        def run():
+            nonlocal result
+            result = _sample(seconds, max(interval_ms / 1000, MIN_INTERVAL_SECONDS))
+
+        # A dedicated thread so the requesting thread shows up waiting, not sampling
+        sampler = threading.Thread(target=run, name="profiler", daemon=True)
+        sampler.start()
+        sampler.join()
+        if memory:
+            result["allocations"] = _top_allocations(tracemalloc.take_snapshot())
+        return result
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _running.release()
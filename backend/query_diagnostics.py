@@ -0,0 +1,191 @@
+"""
+Opt-in slow-query and N+1 detection for the CRUD layer.
+
+SQLAlchemy cursor events are recorded into a per-request collector. When the
+request finishes, statements are grouped by their normalized SQL shape, and
+two kinds of problems are logged together with the route and the calling
+``crud`` function:
+
+- the same statement shape executed many times in one request (usually a lazy
+  relationship such as ``Session.trainer`` loaded row by row);
+- single statements slower than a latency threshold.
+
+Enable it for the API with ``QUERY_DIAGNOSTICS=1``. The thresholds come from
+``QUERY_SLOW_MS`` (default 100) and ``QUERY_REPEAT_THRESHOLD`` (default 5).
+
+Tests can use ``track()`` or ``query_budget()`` whether or not the environment
+flag is set. Both collect process-wide by default, because TestClient runs the
+app on its own event-loop thread where the caller's context is not visible:
+
+    with query_diagnostics.query_budget(3):
+        client.get("/sessions/", headers=headers)
+"""
+
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("QUERY_DIAGNOSTICS", "0").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("QUERY_SLOW_MS", "100"))
+REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+_CRUD_MODULE = __name__.rsplit(".", 1)[0] + ".crud"
+
+_whitespace = re.compile(r"\s+")
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r"\b\d+(?:\.\d+)?\b")
+_placeholder = re.compile(r"%\(\w+\)s|%s|\?|:\w+")
+_placeholder_list = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def normalize_sql(statement: str) -> str:
+    """Reduce a statement to its shape so that N+1 loops group together."""
+    shape = _whitespace.sub(" ", statement).strip()
+    shape = _string_literal.sub("?", shape)
+    shape = _placeholder.sub("?", shape)
+    shape = _number_literal.sub("?", shape)
+    # IN lists expand to a varying number of placeholders
+    return _placeholder_list.sub("(?)", shape)
+
+
+@dataclass
+class QueryStat:
+    shape: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    callers: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class QueryCollector:
+    route: str = ""
+    stats: Dict[str, QueryStat] = field(default_factory=dict)
+    slow: List[QueryStat] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+        return sum(stat.count for stat in self.stats.values())
+
+    def record(self, statement: str, elapsed_ms: float, caller: Optional[str]):
+        shape = normalize_sql(statement)
+        stat = self.stats.get(shape)
+        if stat is None:
+            stat = self.stats[shape] = QueryStat(shape)
+        stat.count += 1
+        stat.total_ms += elapsed_ms
+        stat.max_ms = max(stat.max_ms, elapsed_ms)
+        if caller:
+            stat.callers.add(caller)
+        if elapsed_ms >= SLOW_QUERY_MS:
+            self.slow.append(QueryStat(shape, 1, elapsed_ms, elapsed_ms, {caller} if caller else set()))
+
+    def repeated(self, threshold: int = REPEAT_THRESHOLD) -> List[QueryStat]:
+        return sorted(
+            (stat for stat in self.stats.values() if stat.count >= threshold),
+            key=lambda stat: stat.count,
+            reverse=True,
+        )
+
+    def report(self):
+        for stat in self.repeated():
+            logger.warning(
+                "Possible N+1 on %s: %d x %s (%.1f ms total, called from %s)",
+                self.route or "<no route>", stat.count, stat.shape, stat.total_ms,
+                ", ".join(sorted(stat.callers)) or "<outside crud>",
+            )
+        for stat in self.slow:
+            logger.warning(
+                "Slow query on %s: %.1f ms %s (called from %s)",
+                self.route or "<no route>", stat.max_ms, stat.shape,
+                ", ".join(sorted(stat.callers)) or "<outside crud>",
+            )
+
+
+_collector: ContextVar[Optional[QueryCollector]] = ContextVar("query_collector", default=None)
+_process_collector: Optional[QueryCollector] = None
+
+
+def _active_collector() -> Optional[QueryCollector]:
+    collector = _collector.get()
+    return collector if collector is not None else _process_collector
+
+
+def _calling_crud_function() -> Optional[str]:
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == _CRUD_MODULE:
+            return f"crud.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_collector() is not None:
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collector = _active_collector()
+    if collector is None or not conn.info.get("query_start_time"):
+        return
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    collector.record(statement, elapsed_ms, _calling_crud_function())
+
+
+@contextmanager
+def track(route: str = "", process_wide: bool = True):
+    """Collect executed statements into a QueryCollector.
+
+    With process_wide=False only statements issued from the current context
+    (the current request) are collected.
+    """
+    global _process_collector
+    collector = QueryCollector(route=route)
+    if process_wide:
+        previous, _process_collector = _process_collector, collector
+        try:
+            yield collector
+        finally:
+            _process_collector = previous
+        return
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries: int, route: str = ""):
+    """Fail with AssertionError if the block issues more than max_queries statements."""
+    with track(route) as collector:
+        yield collector
+    if collector.total > max_queries:
+        shapes = "\n".join(f"  {stat.count} x {stat.shape}" for stat in collector.stats.values())
+        raise AssertionError(
+            f"{route or 'block'} issued {collector.total} queries, budget is {max_queries}:\n{shapes}"
+        )
+
+
+async def diagnostics_middleware(request, call_next):
+    with track(f"{request.method} {request.url.path}", process_wide=False) as collector:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            collector.route = f"{request.method} {route.path}"
+    collector.report()
+    return response
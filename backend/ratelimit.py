@@ -0,0 +1,122 @@
+"""
+Admission control for /auth/login.
+
+Every login attempt costs a pbkdf2 verification, so attempts are admitted
+through token buckets before any hashing or database work happens. Rejected
+attempts get 429 with a Retry-After header. There are three buckets:
+
+- per client IP, which caps how much one host can send;
+- per (IP, username), which is strict and stops password guessing against
+  one account from one host;
+- per username, which is loose and only caps guessing spread over many IPs.
+
+The per-username bucket is kept loose because anyone who knows a username
+can drain it. A strict per-username limit would let an attacker lock that
+user out from rotating IPs. A successful login gives back its (IP, username)
+and username tokens, so a user signing in from several devices is not
+throttled by their own logins.
+
+Buckets live in a bounded LRU map holding one (tokens, timestamp) tuple per
+key. A bucket that has been idle long enough to refill completely behaves
+like a new one, so those entries are dropped as they age out of the front of
+the map, and the least recently used key is evicted when the map is full.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "20"))
+LOGIN_IP_USER_BURST = int(os.getenv("LOGIN_IP_USER_BURST", "5"))
+LOGIN_IP_USER_PER_MINUTE = float(os.getenv("LOGIN_IP_USER_PER_MINUTE", "5"))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", "50"))
+LOGIN_USER_PER_MINUTE = float(os.getenv("LOGIN_USER_PER_MINUTE", "30"))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: int, per_minute: float, max_keys: int):
+        self.capacity = float(capacity)
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        # Idle time after which a bucket is full again and can be forgotten
+        self._idle_expiry = self.capacity / self.rate if self.rate > 0 else float("inf")
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _expire(self, now: float):
+        while self._buckets:
+            _, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self._idle_expiry and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    def available(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key: str, now: float) -> float:
+        """Seconds until key has a token, 0 if it has one now."""
+        missing = 1.0 - self.available(key, now)
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, key: str, now: float):
+        tokens = self.available(key, now) - 1.0
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        self._expire(now)
+
+    def refund(self, key: str, now: float):
+        """Give back one token taken from key, if its bucket is still tracked."""
+        if key in self._buckets:
+            self._buckets[key] = (min(self.capacity, self.available(key, now) + 1.0), now)
+
+
+class LoginThrottle:
+    """Admits a login attempt only if its IP, (IP, username) and username buckets all have a token."""
+
+    def __init__(self, ip_limiter: TokenBucketLimiter, ip_user_limiter: TokenBucketLimiter,
+                 user_limiter: TokenBucketLimiter):
+        self.ip_limiter = ip_limiter
+        self.ip_user_limiter = ip_user_limiter
+        self.user_limiter = user_limiter
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _keys(self, ip: str, username: str):
+        username = username.strip().lower()
+        return ((self.ip_limiter, ip), (self.ip_user_limiter, f"{ip} {username}"), (self.user_limiter, username))
+
+    def check(self, ip: str, username: str, now: Optional[float] = None) -> float:
+        """Consume one attempt and return 0, or return the Retry-After seconds without consuming."""
+        now = time.monotonic() if now is None else now
+        keys = self._keys(ip, username)
+        with self._lock:
+            wait = max(limiter.retry_after(key, now) for limiter, key in keys)
+            if wait > 0:
+                self.rejected += 1
+                return wait
+            for limiter, key in keys:
+                limiter.consume(key, now)
+            return 0.0
+
+    def succeeded(self, ip: str, username: str, now: Optional[float] = None):
+        """Give back the (IP, username) and username tokens of a successful login; the IP's stays spent."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for limiter, key in self._keys(ip, username)[1:]:
+                limiter.refund(key, now)
+
+
+login_throttle = LoginThrottle(
+    TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE, LOGIN_THROTTLE_MAX_KEYS),
+    TokenBucketLimiter(LOGIN_IP_USER_BURST, LOGIN_IP_USER_PER_MINUTE, LOGIN_THROTTLE_MAX_KEYS),
+    TokenBucketLimiter(LOGIN_USER_BURST, LOGIN_USER_PER_MINUTE, LOGIN_THROTTLE_MAX_KEYS),
+)
@@ -0,0 +1,203 @@
+"""
+WebSocket fan-out for /ws: broadcasts, heartbeats and connection limits.
+
+Each broadcast is JSON-encoded once and the same text frame is sent to all
+connections. With a coalescing window (``WS_COALESCE_MS``), events arriving
+within the window are sent together as one
+{"type": "batch", "events": [...]} frame. Sends run concurrently, and each
+one is bounded by ``WS_SEND_TIMEOUT_SECONDS``, so one stuck peer cannot hold
+up a broadcast for everyone else.
+
+Peers that vanish without a close frame, such as a laptop lid shut or a
+dropped Wi-Fi link, leave half-open TCP connections. Those can go on
+accepting sends for a long time. So every ``WS_PING_INTERVAL_SECONDS`` the
+server sends one {"type": "ping"} frame to all connections and clients answer
+{"type": "pong"}. Browsers do not expose protocol-level pings to scripts, so
+this happens at the message level. Any frame from a client counts as a sign
+of life. A connection that has sent nothing within ``WS_PONG_TIMEOUT_SECONDS``
+of a ping is closed and dropped.
+
+Clients authenticate with their access token as a WebSocket subprotocol
+(``new WebSocket(url, ["access_token", token])``) rather than in the URL,
+where it would end up in access logs. A user may hold
+``WS_MAX_CONNECTIONS_PER_USER`` connections. Opening one more
+closes their oldest connection, which is usually a stale tab. Once a worker
+has ``WS_MAX_CONNECTIONS`` connections, it refuses new ones.
+
+``stats()`` is the per-worker gauge: live connections, the peak, and the
+totals accepted, refused and closed by reason.
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from fastapi import WebSocket
+from pydantic import BaseModel
+
+from . import serialization
+
+WS_COALESCE_MS = float(os.getenv("WS_COALESCE_MS", "0"))
+WS_PING_INTERVAL_SECONDS = float(os.getenv("WS_PING_INTERVAL_SECONDS", "20"))
+WS_PONG_TIMEOUT_SECONDS = float(os.getenv("WS_PONG_TIMEOUT_SECONDS", "10"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "5"))
+WS_MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "5"))
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+
+PING_FRAME = '{"type":"ping"}'
+# Clients authenticate with the subprotocols ["access_token", <token>]; this one is echoed back
+TOKEN_SUBPROTOCOL = "access_token"
+
+# Close codes (RFC 6455)
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class _Connection:
+    __slots__ = ("websocket", "user_id", "last_seen")
+
+    def __init__(self, websocket: WebSocket, user_id: int, last_seen: float):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.last_seen = last_seen
+
+
+class ConnectionManager:
+    """Broadcasts events to every connected client and reaps dead connections.
+
+    With ping_interval=None no heartbeat task is started and the caller drives
+    ping() and reap_silent().
+    """
+
+    def __init__(self, coalesce_seconds: float = 0, ping_interval: Optional[float] = WS_PING_INTERVAL_SECONDS,
+                 pong_timeout: float = WS_PONG_TIMEOUT_SECONDS, send_timeout: float = WS_SEND_TIMEOUT_SECONDS,
+                 max_per_user: int = WS_MAX_CONNECTIONS_PER_USER, max_connections: int = WS_MAX_CONNECTIONS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.coalesce_seconds = coalesce_seconds
+        self.ping_interval = ping_interval
+        self.pong_timeout = pong_timeout
+        self.send_timeout = send_timeout
+        self.max_per_user = max_per_user
+        self.max_connections = max_connections
+        self.clock = clock
+        self.active_connections: Dict[WebSocket, _Connection] = {}
+        self._by_user: Dict[int, List[_Connection]] = {}  # oldest first
+        self._pending: List[dict] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._last_ping: Optional[float] = None
+        self.peak = 0
+        self.accepted = 0
+        self.refused = 0
+        self.closed: Counter = Counter()
+
+    async def connect(self, websocket: WebSocket, user_id: int) -> bool:
+        """Accept websocket for user_id; False if the worker is full and it was refused."""
+        if len(self.active_connections) >= self.max_connections:
+            self.refused += 1
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return False
+        await websocket.accept(subprotocol=TOKEN_SUBPROTOCOL)
+        user_connections = self._by_user.setdefault(user_id, [])
+        if len(user_connections) >= self.max_per_user:
+            await asyncio.gather(*(
+                self._close(connection, "evicted", CLOSE_POLICY_VIOLATION)
+                for connection in user_connections[:len(user_connections) - self.max_per_user + 1]
+            ))
+            user_connections = self._by_user.setdefault(user_id, [])
+        connection = _Connection(websocket, user_id, self.clock())
+        self.active_connections[websocket] = connection
+        user_connections.append(connection)
+        self.accepted += 1
+        self.peak = max(self.peak, len(self.active_connections))
+        if self.ping_interval is not None and (self._heartbeat_task is None or self._heartbeat_task.done()):
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        return True
+
+    def disconnect(self, websocket: WebSocket, reason: str = "disconnected"):
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        user_connections = self._by_user[connection.user_id]
+        user_connections.remove(connection)
+        if not user_connections:
+            del self._by_user[connection.user_id]
+        self.closed[reason] += 1
+
+    def received(self, websocket: WebSocket):
+        """Record a frame from the client (a pong or anything else) as a sign of life."""
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = self.clock()
+
+    async def _close(self, connection: _Connection, reason: str, code: int):
+        self.disconnect(connection.websocket, reason)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass  # already gone
+
+    async def _heartbeat(self):
+        # Runs while there are connections; connect() restarts it
+        while self.active_connections:
+            await self.ping()
+            await asyncio.sleep(self.pong_timeout)
+            await self.reap_silent()
+            await asyncio.sleep(max(0.0, self.ping_interval - self.pong_timeout))
+        self._heartbeat_task = None
+
+    async def ping(self):
+        self._last_ping = self.clock()
+        await self._send_frame(PING_FRAME)
+
+    async def reap_silent(self):
+        """Close connections that have not sent anything since the last ping."""
+        if self._last_ping is None:
+            return
+        await asyncio.gather(*(
+            self._close(connection, "timed_out", CLOSE_GOING_AWAY)
+            for connection in list(self.active_connections.values()) if connection.last_seen < self._last_ping
+        ))
+
+    async def broadcast(self, event_type: str, event: BaseModel):
+        message = {"type": event_type, "data": event.model_dump(mode="json", exclude_none=True)}
+        if self.coalesce_seconds <= 0:
+            await self._send_frame(serialization.dumps(message).decode("utf-8"))
+            return
+        self._pending.append(message)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.coalesce_seconds)
+        events, self._pending = self._pending, []
+        self._flush_task = None
+        frame = events[0] if len(events) == 1 else {"type": "batch", "events": events}
+        await self._send_frame(serialization.dumps(frame).decode("utf-8"))
+
+    async def _send_frame(self, frame: str):
+        connections = list(self.active_connections.values())
+        results = await asyncio.gather(*(
+            asyncio.wait_for(connection.websocket.send_text(frame), self.send_timeout) for connection in connections
+        ), return_exceptions=True)
+        await asyncio.gather(*(
+            self._close(connection, "send_failed", CLOSE_GOING_AWAY)
+            for connection, result in zip(connections, results)
+            if isinstance(result, Exception) and connection.websocket in self.active_connections
+        ))
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self.active_connections),
+            "live_users": len(self._by_user),
+            "peak": self.peak,
+            "accepted": self.accepted,
+            "refused": self.refused,
+            "closed": dict(self.closed),
+        }
+
+
+manager = ConnectionManager(coalesce_seconds=WS_COALESCE_MS / 1000)
@@ -0,0 +1,226 @@
+"""
+Recurring session series, expanded lazily.
+
+A ``SessionSeries`` row stores a rule: the first start, a daily or weekly
+step of ``repeat_every`` days/weeks, and an optional ``occurrence_count``
+and/or ``until`` bound. Occurrences are not stored. They are computed by
+arithmetic only for the date window a caller asks about, so a weekly training
+costs one row however long it runs. Rescheduling the whole series is a
+single-row update.
+
+An occurrence is stored only when someone changes it. Updating or completing
+it creates a normal ``sessions`` row. Skipping it stores nothing but the
+exception. Either way a ``SeriesException`` keyed by (series, rule slot)
+records that the rule's slot is no longer virtual. Exceptions are keyed by
+the original slot. After the rule itself changes, an old exception only
+matches if the new rule still produces its slot.
+
+Reads that work on a window (the calendar and windowed session analytics)
+merge the stored sessions with the expanded occurrences. Unwindowed reads,
+such as /sessions/ and overall counts, see stored sessions only.
+
+Unstored occurrences still take up their trainer's and trainee's time. A new
+session is checked against the occurrences that may overlap it
+(``occurrences_overlapping``). A series write is checked by ``check_series``
+for the next ``SERIES_CHECK_DAYS``, because a rule without an end has no
+last occurrence to check up to.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from . import models, scheduling
+from .schemas import MAX_SESSION_MINUTES
+
+# Longest window expanded per request
+MAX_WINDOW_DAYS = 366
+# How far ahead a series write is checked for double bookings
+SERIES_CHECK_DAYS = int(os.getenv("SERIES_CHECK_DAYS", str(MAX_WINDOW_DAYS)))
+
+
+class NotAnOccurrence(Exception):
+    """Raised when a datetime is not a slot of the series' rule."""
+
+
+def _step(series) -> timedelta:
+    days = 7 if series.frequency == models.RecurrenceFrequency.weekly else 1
+    return timedelta(days=days * series.repeat_every)
+
+
+def _within_bounds(series, index: int, start: datetime) -> bool:
+    if series.occurrence_count is not None and index >= series.occurrence_count:
+        return False
+    return series.until is None or start <= series.until
+
+
+def occurrence_starts(series, start: datetime, end: datetime) -> Iterator[datetime]:
+    """Slots of the series' rule in [start, end), in order."""
+    step = _step(series)
+    # First index whose slot is at or after start
+    index = max(0, -((series.starts_at - start) // step))
+    while True:
+        slot = series.starts_at + index * step
+        if slot >= end or not _within_bounds(series, index, slot):
+            return
+        yield slot
+        index += 1
+
+
+def check_slot(series, slot: datetime):
+    """Raise NotAnOccurrence unless slot is produced by the series' rule."""
+    step = _step(series)
+    offset = slot - series.starts_at
+    if offset < timedelta(0) or offset % step or not _within_bounds(series, offset // step, slot):
+        raise NotAnOccurrence(slot)
+
+
+def _check_window(start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    start, end = scheduling.naive_utc(start), scheduling.naive_utc(end)
+    if not start < end <= start + timedelta(days=MAX_WINDOW_DAYS):
+        raise ValueError(f"Window must be positive and at most {MAX_WINDOW_DAYS} days")
+    return start, end
+
+
+def _user_filter(model, user_ids: Sequence[int]):
+    return or_(model.trainer_id.in_(user_ids), model.trainee_id.in_(user_ids))
+
+
+def _virtual_occurrences(db: Session, start: datetime, end: datetime, user_ids: Optional[Sequence[int]]) -> List[dict]:
+    query = db.query(models.SessionSeries).filter(
+        models.SessionSeries.starts_at < end,
+        or_(models.SessionSeries.until.is_(None), models.SessionSeries.until >= start),
+    )
+    if user_ids is not None:
+        query = query.filter(_user_filter(models.SessionSeries, user_ids))
+    series_list = query.all()
+    if not series_list:
+        return []
+
+    taken: Set[Tuple[int, datetime]] = set(db.query(
+        models.SeriesException.series_id, models.SeriesException.occurrence_start
+    ).filter(
+        models.SeriesException.series_id.in_([series.id for series in series_list]),
+        models.SeriesException.occurrence_start >= start,
+        models.SeriesException.occurrence_start < end,
+    ))
+    return [
+        {"title": series.title, "description": series.description,
+         "trainer_id": series.trainer_id, "trainee_id": series.trainee_id,
+         "scheduled_date": slot, "duration_minutes": series.duration_minutes,
+         "status": models.SessionStatus.scheduled, "session_id": None,
+         "series_id": series.id, "occurrence_start": slot}
+        for series in series_list
+        for slot in occurrence_starts(series, start, end)
+        if (series.id, slot) not in taken
+    ]
+
+
+def calendar(db: Session, start: datetime, end: datetime, user_id: Optional[int] = None) -> List[dict]:
+    """schemas.Occurrence dicts starting in [start, end): stored sessions plus expanded series occurrences."""
+    start, end = _check_window(start, end)
+    # Both tiers, as in count_by_status: archived occurrences keep their slot taken
+    sessions = []
+    for model in (models.Session, models.ArchivedSession):
+        query = db.query(model).filter(model.scheduled_date >= start, model.scheduled_date < end)
+        if user_id is not None:
+            query = query.filter(_user_filter(model, [user_id]))
+        sessions += query.all()
+
+    # Stored occurrences keep pointing at their series slot
+    slots: Dict[int, Tuple[int, datetime]] = {}
+    if sessions:
+        slots = {
+            session_id: (series_id, occurrence_start)
+            for session_id, series_id, occurrence_start in db.query(
+                models.SeriesException.session_id, models.SeriesException.series_id,
+                models.SeriesException.occurrence_start,
+            ).filter(models.SeriesException.session_id.in_([session.id for session in sessions]))
+        }
+
+    entries = []
+    for session in sessions:
+        series_id, occurrence_start = slots.get(session.id, (None, None))
+        entries.append({
+            "title": session.title, "description": session.description,
+            "trainer_id": session.trainer_id, "trainee_id": session.trainee_id,
+            "scheduled_date": session.scheduled_date, "duration_minutes": session.duration_minutes,
+            "status": session.status, "session_id": session.id,
+            "series_id": series_id, "occurrence_start": occurrence_start,
+        })
+    entries += _virtual_occurrences(db, start, end, None if user_id is None else [user_id])
+    entries.sort(key=lambda entry: entry["scheduled_date"])
+    return entries
+
+
+def count_by_status(db: Session, start: datetime, end: datetime) -> Dict[str, int]:
+    """Sessions starting in [start, end) by status, both tiers, with expanded occurrences as scheduled."""
+    start, end = _check_window(start, end)
+    counts: Dict[str, int] = {}
+    for model in (models.Session, models.ArchivedSession):
+        result = db.query(model.status, func.count(model.id)).filter(
+            model.scheduled_date >= start, model.scheduled_date < end
+        ).group_by(model.status).all()
+        for status, count in result:
+            counts[status.value] = counts.get(status.value, 0) + count
+    virtual = len(_virtual_occurrences(db, start, end, None))
+    if virtual:
+        counts[models.SessionStatus.scheduled.value] = counts.get(models.SessionStatus.scheduled.value, 0) + virtual
+    return counts
+
+
+def occurrences_overlapping(db: Session, user_ids: Sequence[int], start: datetime, end: datetime,
+                            exclude_series_id: Optional[int] = None) -> List[dict]:
+    """Unstored occurrences (as in calendar) of any of user_ids' series that overlap [start, end)."""
+    start, end = scheduling.naive_utc(start), scheduling.naive_utc(end)
+    # As in scheduling: only occurrences starting in [start - MAX_SESSION_MINUTES, end) can overlap
+    lookback = start - timedelta(minutes=MAX_SESSION_MINUTES)
+    return [
+        occurrence for occurrence in _virtual_occurrences(db, lookback, end, user_ids)
+        if occurrence["series_id"] != exclude_series_id
+        and occurrence["scheduled_date"] + timedelta(minutes=occurrence["duration_minutes"]) > start
+    ]
+
+
+def check_series(db: Session, series):
+    """Raise scheduling.ScheduleConflict if the series double-books its trainer or trainee.
+
+    Its unstored occurrences over the next SERIES_CHECK_DAYS are checked
+    against stored sessions and other series' occurrences. Call inside the
+    transaction that writes the series, after flushing it, and commit right after.
+    """
+    user_ids = [series.trainer_id, series.trainee_id]
+    scheduling.lock_users(db, user_ids)
+    start = max(series.starts_at, datetime.utcnow())
+    end = start + timedelta(days=SERIES_CHECK_DAYS)
+    taken = {occurrence_start for (occurrence_start,) in db.query(models.SeriesException.occurrence_start).filter(
+        models.SeriesException.series_id == series.id,
+        models.SeriesException.occurrence_start >= start,
+        models.SeriesException.occurrence_start < end,
+    )}
+    slots = [slot for slot in occurrence_starts(series, start, end) if slot not in taken]
+    if not slots:
+        return
+
+    # One query each for the stored sessions and the other series in the checked span
+    duration = timedelta(minutes=series.duration_minutes)
+    span_start, span_end = slots[0], slots[-1] + duration
+    sessions = scheduling.session_intervals(db, user_ids, span_start, span_end)
+    others = sorted(
+        (occurrence["scheduled_date"], occurrence["scheduled_date"] + timedelta(minutes=occurrence["duration_minutes"]),
+         (occurrence["series_id"], occurrence["occurrence_start"]))
+        for occurrence in occurrences_overlapping(db, user_ids, span_start, span_end, exclude_series_id=series.id)
+    )
+    session_ids, occurrences = set(), set()
+    for slot in slots:
+        session_id = scheduling.first_overlap(sessions, slot, slot + duration)
+        if session_id is not None:
+            session_ids.add(session_id)
+        occurrence = scheduling.first_overlap(others, slot, slot + duration)
+        if occurrence is not None:
+            occurrences.add(occurrence)
+    if session_ids or occurrences:
+        raise scheduling.ScheduleConflict(sorted(session_ids), sorted(occurrences))
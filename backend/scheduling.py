@@ -0,0 +1,191 @@
+"""
+Schedule conflict detection and free-slot search.
+
+Sessions are indexed on (trainer_id, scheduled_date) and
+(trainee_id, scheduled_date). Durations are capped at
+``schemas.MAX_SESSION_MINUTES``, so any session overlapping [start, end) must
+start in [start - MAX_SESSION_MINUTES, end). That makes every overlap lookup a
+bounded index range scan, however long a user's calendar grows. The exact end
+times are then compared in Python on the few rows that come back.
+
+The check and the write that follows it run in one transaction. Before
+checking, the trainer and trainee ``users`` rows are locked with
+SELECT ... FOR UPDATE, in ID order so that concurrent bookings cannot
+deadlock. Two bookings for the same person are therefore serialized, and
+the second one sees the first one's session. SQLite has no row locks and
+serializes writers on its own.
+
+Occurrences of recurring series count as bookings too. A new session is
+checked against the unstored occurrences that may overlap it, and a series
+write is checked by ``recurrence.check_series``.
+"""
+
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from . import models
+from .schemas import MAX_SESSION_MINUTES
+
+Interval = Tuple[datetime, datetime]
+
+
+class ScheduleConflict(Exception):
+    def __init__(self, conflicting_session_ids: List[int], conflicting_occurrences: Sequence[Tuple[int, datetime]] = ()):
+        self.conflicting_session_ids = conflicting_session_ids
+        # (series_id, occurrence_start) of unstored series occurrences
+        self.conflicting_occurrences = list(conflicting_occurrences)
+        super().__init__(f"Overlaps sessions {conflicting_session_ids} and series occurrences {self.conflicting_occurrences}")
+
+
+def naive_utc(value: datetime) -> datetime:
+    # Timestamps are stored as naive UTC
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _busy_query(db: Session, user_ids: Sequence[int], start: datetime, end: datetime, *extra_columns):
+    lookback = start - timedelta(minutes=MAX_SESSION_MINUTES)
+
+    def in_window(user_column):
+        return and_(user_column.in_(user_ids), models.Session.scheduled_date >= lookback, models.Session.scheduled_date < end)
+
+    return db.query(
+        models.Session.id, models.Session.scheduled_date, models.Session.duration_minutes, *extra_columns
+    ).filter(
+        or_(in_window(models.Session.trainer_id), in_window(models.Session.trainee_id)),
+        models.Session.status != models.SessionStatus.cancelled,
+    )
+
+
+def find_conflicts(db: Session, user_ids: Sequence[int], start: datetime, duration_minutes: int,
+                   exclude_session_id: Optional[int] = None) -> List[int]:
+    """IDs of non-cancelled sessions of any of user_ids that overlap the given slot."""
+    start = naive_utc(start)
+    end = start + timedelta(minutes=duration_minutes)
+    conflicts = []
+    for session_id, scheduled_date, duration in _busy_query(db, user_ids, start, end):
+        if session_id == exclude_session_id:
+            continue
+        if scheduled_date + timedelta(minutes=duration) > start:
+            conflicts.append(session_id)
+    return conflicts
+
+
+def lock_users(db: Session, user_ids: Iterable[int]):
+    """Lock the users' rows until the caller's transaction ends, serializing their bookings."""
+    db.query(models.User.id).filter(models.User.id.in_(sorted(set(user_ids)))).order_by(models.User.id).with_for_update().all()
+
+
+def check_session(db: Session, session, exclude_session_id: Optional[int] = None):
+    """Raise ScheduleConflict if a scheduled session double-books its trainer or trainee.
+
+    Checked against stored sessions and unstored series occurrences. Call
+    inside the transaction that writes the session and commit right after.
+    """
+    # Imported here: recurrence builds on this module
+    from . import recurrence
+
+    if session.status not in (None, models.SessionStatus.scheduled):
+        return
+    user_ids = [session.trainer_id, session.trainee_id]
+    lock_users(db, user_ids)
+    conflicts = find_conflicts(
+        db, user_ids, session.scheduled_date, session.duration_minutes, exclude_session_id=exclude_session_id,
+    )
+    start = naive_utc(session.scheduled_date)
+    occurrences = [
+        (occurrence["series_id"], occurrence["occurrence_start"])
+        for occurrence in recurrence.occurrences_overlapping(
+            db, user_ids, start, start + timedelta(minutes=session.duration_minutes)
+        )
+    ]
+    if conflicts or occurrences:
+        raise ScheduleConflict(conflicts, occurrences)
+
+
+def busy_by_user(db: Session, user_ids: Sequence[int], start: datetime, end: datetime) -> Dict[int, List[Tuple[datetime, datetime, str]]]:
+    """Sorted (start, end, label) of each user's sessions that may overlap [start, end), in one query.
+
+    For checking many new sessions at once with first_overlap(); new sessions
+    can be added to the lists with bisect.insort as they are accepted.
+    """
+    start, end = naive_utc(start), naive_utc(end)
+    wanted = set(user_ids)
+    busy: Dict[int, List[Tuple[datetime, datetime, str]]] = {user_id: [] for user_id in wanted}
+    for session_id, scheduled_date, duration, trainer_id, trainee_id in _busy_query(
+        db, list(wanted), start, end, models.Session.trainer_id, models.Session.trainee_id
+    ):
+        interval = (scheduled_date, scheduled_date + timedelta(minutes=duration), f"session {session_id}")
+        for user_id in {trainer_id, trainee_id} & wanted:
+            busy[user_id].append(interval)
+    for intervals in busy.values():
+        intervals.sort()
+    return busy
+
+
+def session_intervals(db: Session, user_ids: Sequence[int], start: datetime, end: datetime) -> List[Tuple[datetime, datetime, int]]:
+    """Sorted (start, end, session_id) of sessions of any of user_ids that may overlap [start, end), for first_overlap()."""
+    return sorted(
+        (scheduled_date, scheduled_date + timedelta(minutes=duration), session_id)
+        for session_id, scheduled_date, duration in _busy_query(db, user_ids, naive_utc(start), naive_utc(end))
+    )
+
+
+def first_overlap(intervals: Sequence[Tuple[datetime, datetime, Any]], start: datetime, end: datetime) -> Optional[Any]:
+    """Label of an interval overlapping [start, end) in a list sorted by start, or None."""
+    position = bisect_left(intervals, (end,))
+    lookback = start - timedelta(minutes=MAX_SESSION_MINUTES)
+    # Only intervals starting in [start - MAX_SESSION_MINUTES, end) can overlap
+    while position > 0 and intervals[position - 1][0] >= lookback:
+        position -= 1
+        if intervals[position][1] > start:
+            return intervals[position][2]
+    return None
+
+
+def busy_intervals(db: Session, user_ids: Sequence[int], start: datetime, end: datetime) -> List[Interval]:
+    """Merged busy intervals of user_ids clipped to [start, end)."""
+    start, end = naive_utc(start), naive_utc(end)
+    intervals = []
+    for _, scheduled_date, duration in _busy_query(db, user_ids, start, end):
+        busy_end = scheduled_date + timedelta(minutes=duration)
+        if busy_end > start:
+            intervals.append((max(scheduled_date, start), min(busy_end, end)))
+    return merge_intervals(intervals)
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_slots(busy: Sequence[Interval], start: datetime, end: datetime, duration_minutes: int) -> List[Interval]:
+    """Gaps of at least duration_minutes between merged busy intervals within [start, end)."""
+    needed = timedelta(minutes=duration_minutes)
+    slots = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start - cursor >= needed:
+            slots.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if end - cursor >= needed:
+        slots.append((cursor, end))
+    return slots
+
+
+def find_free_slots(db: Session, user_ids: Sequence[int], start: datetime, end: datetime,
+                    duration_minutes: int) -> List[Interval]:
+    """Windows in which all user_ids are free for at least duration_minutes."""
+    start, end = naive_utc(start), naive_utc(end)
+    return free_slots(busy_intervals(db, user_ids, start, end), start, end, duration_minutes)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 from enum import Enum
 
 class UserRole(str, Enum):
@@ -13,6 +13,9 @@ class SessionStatus(str, Enum):
     completed = "completed"
     cancelled = "cancelled"
 
+# Upper bound that keeps schedule overlap checks to a bounded index range
+MAX_SESSION_MINUTES = 24 * 60
+
 # User schemas
 class UserBase(BaseModel):
     username: str
@@ -33,12 +36,14 @@ class UserUpdate(BaseModel):
     last_name: Optional[str] = None
     password: Optional[str] = None
     is_temporary_password: Optional[bool] = None
+    version: Optional[int] = None  # if given, only update while the user is still at this version
 
 class User(UserBase):
     id: int
     is_temporary_password: bool
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
@@ -50,7 +55,7 @@ class SessionBase(BaseModel):
     trainer_id: int
     trainee_id: int
     scheduled_date: datetime
-    duration_minutes: int
+    duration_minutes: int = Field(gt=0, le=MAX_SESSION_MINUTES)
     status: SessionStatus = SessionStatus.scheduled
 
 class SessionCreate(SessionBase):
@@ -62,17 +67,67 @@ class SessionUpdate(BaseModel):
     trainer_id: Optional[int] = None
     trainee_id: Optional[int] = None
     scheduled_date: Optional[datetime] = None
-    duration_minutes: Optional[int] = None
+    duration_minutes: Optional[int] = Field(default=None, gt=0, le=MAX_SESSION_MINUTES)
     status: Optional[SessionStatus] = None
+    version: Optional[int] = None  # if given, only update while the session is still at this version
 
 class Session(SessionBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         from_attributes = True
 
+# Recurring series schemas
+class RecurrenceFrequency(str, Enum):
+    daily = "daily"
+    weekly = "weekly"
+
+class SessionSeriesBase(BaseModel):
+    title: str
+    description: Optional[str] = None
+    trainer_id: int
+    trainee_id: int
+    starts_at: datetime
+    duration_minutes: int = Field(gt=0, le=MAX_SESSION_MINUTES)
+    frequency: RecurrenceFrequency = RecurrenceFrequency.weekly
+    repeat_every: int = Field(1, ge=1, le=52)
+    until: Optional[datetime] = None
+    occurrence_count: Optional[int] = Field(None, ge=1)
+
+class SessionSeriesCreate(SessionSeriesBase):
+    pass
+
+class SessionSeriesUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    trainer_id: Optional[int] = None
+    trainee_id: Optional[int] = None
+    starts_at: Optional[datetime] = None
+    duration_minutes: Optional[int] = Field(default=None, gt=0, le=MAX_SESSION_MINUTES)
+    frequency: Optional[RecurrenceFrequency] = None
+    repeat_every: Optional[int] = Field(default=None, ge=1, le=52)
+    until: Optional[datetime] = None
+    occurrence_count: Optional[int] = Field(default=None, ge=1)
+    version: Optional[int] = None  # if given, only update while the series is still at this version
+
+class SessionSeries(SessionSeriesBase):
+    id: int
+    created_at: datetime
+    updated_at: datetime
+    version: int
+
+    class Config:
+        from_attributes = True
+
+class Occurrence(SessionBase):
+    """A calendar entry: a stored session, or a series occurrence expanded on the fly."""
+    session_id: Optional[int] = None  # None until the occurrence is stored as a session
+    series_id: Optional[int] = None
+    occurrence_start: Optional[datetime] = None  # the series slot, kept when the occurrence is moved
+
 # Authentication schemas
 class LoginRequest(BaseModel):
     username: str
@@ -87,10 +142,43 @@ class TokenResponse(BaseModel):
 # Real-time update schemas
 class SessionUpdateEvent(BaseModel):
     session_id: int
-    status: SessionStatus
-    updated_at: datetime
+    status: Optional[SessionStatus] = None  # not sent for deletions
+    updated_at: Optional[datetime] = None
 
 class UserUpdateEvent(BaseModel):
     user_id: int
     action: str  # "created", "updated", "deleted"
     user: Optional[User] = None
+
+# Delta sync schemas
+class ChangesResponse(BaseModel):
+    watermark: datetime
+    full_resync_required: bool = False
+    users: List[User] = []
+    sessions: List[Session] = []
+    deleted_user_ids: List[int] = []
+    deleted_session_ids: List[int] = []
+
+# Scheduling schemas
+class TimeSlot(BaseModel):
+    start: datetime
+    end: datetime
+
+# Dashboard schemas
+class DashboardSummary(BaseModel):
+    role: UserRole
+    session_counts: Dict[str, int]
+    upcoming_sessions: List[Session]
+    user_counts: Optional[Dict[str, int]] = None  # admins only
+    sessions: Optional[List[Session]] = None  # trainers and trainees: their own sessions
+    contacts: Optional[List[User]] = None  # their trainees, or their trainers
+
+# Bulk import schemas
+class ImportRowError(BaseModel):
+    row: int  # spreadsheet row number, header is row 1
+    errors: List[str]
+
+class ImportResult(BaseModel):
+    inserted: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []  # first IMPORT_MAX_REPORTED_ERRORS only
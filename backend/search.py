@@ -0,0 +1,306 @@
+"""
+In-process search index over users for the admin user picker.
+
+Two structures are kept per worker:
+
+- a sorted list of (token, user_id, field weight) entries, where tokens are
+  the lowercased username, email, first name and last name. It answers prefix
+  queries with a binary search, and the entries carry everything needed to
+  rank them;
+- a trigram -> user_id posting map over the same fields (email local part
+  only, since the shared domains match nearly everyone). It answers substring
+  queries by intersecting the postings, smallest first.
+
+Candidates are ranked as exact > prefix > substring match, with username
+weighted above names and names above email.
+
+The index is built on a background thread when the worker starts (or on the
+first search if it was not warmed), outside the lock, and swapped in when
+complete. Until then, searches fall back to ``database_search``, so neither
+searches nor user writes wait for the build. Once loaded, it is updated
+directly by the ``crud`` write functions in this worker, and changes made by
+other workers or bulk imports are pulled in through the delta-sync helpers
+(``updated_at`` and tombstones) at most every ``SEARCH_REFRESH_SECONDS``.
+
+The index costs memory in every worker, roughly 1.6 KiB per user. With
+``SEARCH_INDEX=database`` no index is kept and every search uses
+``database_search``, which matches prefixes only: a portable substring index
+would need MySQL ngram full-text or PostgreSQL pg_trgm.
+"""
+
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", "1"))
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "memory")  # "memory" or "database"
+
+# Bounds on how much of the index one query may examine. Prefix matches are
+# scanned in token order, so exact and shorter matches are reached first.
+PREFIX_SCAN_LIMIT = 500
+SUBSTRING_SCAN_LIMIT = 5000
+# Substring matches collected per requested result before ranking
+SUBSTRING_RANKING_POOL = 5
+
+INDEX_FIELDS = ["id", "role", "username", "email", "first_name", "last_name"]
+
+# (weight, position in the document tuple) for username, first name, last name, email
+_FIELD_WEIGHTS = ((3, 1), (2, 3), (2, 4), (1, 2))
+
+_EMPTY: Set[int] = set()
+
+Document = Tuple[str, str, str, str, str]  # role, username, email, first_name, last_name
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _document(role, username: str, email: str, first_name: str, last_name: str) -> Document:
+    role = role.value if hasattr(role, "value") else role
+    return (role, username.lower(), email.lower(), first_name.lower(), last_name.lower())
+
+
+def _tokens(document: Document) -> Dict[str, int]:
+    """Token -> highest field weight it appears with."""
+    tokens: Dict[str, int] = {}
+    for weight, position in _FIELD_WEIGHTS:
+        token = document[position]
+        if token and tokens.get(token, 0) < weight:
+            tokens[token] = weight
+    return tokens
+
+
+def _document_grams(document: Document) -> Set[str]:
+    _, username, email, first_name, last_name = document
+    grams = _trigrams(username) | _trigrams(first_name) | _trigrams(last_name)
+    return grams | _trigrams(email.split("@", 1)[0])
+
+
+def _score(document: Document, query: str) -> Tuple[int, int]:
+    best = (0, 0)
+    for weight, position in _FIELD_WEIGHTS:
+        field = document[position]
+        if field == query:
+            kind = 3
+        elif field.startswith(query):
+            kind = 2
+        elif query in field:
+            kind = 1
+        else:
+            continue
+        # Shorter fields are closer matches
+        best = max(best, (kind * 10 + weight, -len(field)))
+    return best
+
+
+class UserSearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents: Dict[int, Document] = {}
+        self._grams: Dict[str, Set[int]] = {}
+        self._prefix: List[Tuple[str, int, int]] = []
+        self._loaded = False
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+        self._refreshing = threading.Lock()  # held by the one thread building or refreshing
+        self._warm_thread: Optional[threading.Thread] = None
+
+    def __len__(self):
+        return len(self._documents)
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded
+
+    # Maintenance
+
+    def _add(self, user_id: int, document: Document, sort_prefix: bool = True):
+        self._documents[user_id] = document
+        for gram in _document_grams(document):
+            self._grams.setdefault(gram, set()).add(user_id)
+        for token, weight in _tokens(document).items():
+            if sort_prefix:
+                insort(self._prefix, (token, user_id, weight))
+            else:
+                self._prefix.append((token, user_id, weight))
+
+    def _discard(self, user_id: int):
+        document = self._documents.pop(user_id, None)
+        if document is None:
+            return
+        for gram in _document_grams(document):
+            postings = self._grams.get(gram)
+            if postings is not None:
+                postings.discard(user_id)
+                if not postings:
+                    del self._grams[gram]
+        for token in _tokens(document):
+            position = bisect_left(self._prefix, (token, user_id))
+            if position < len(self._prefix) and self._prefix[position][:2] == (token, user_id):
+                del self._prefix[position]
+
+    def upsert(self, user_id: int, role, username: str, email: str, first_name: str, last_name: str):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._discard(user_id)
+            self._add(user_id, _document(role, username, email, first_name, last_name))
+
+    def upsert_user(self, user):
+        self.upsert(user.id, user.role, user.username, user.email, user.first_name, user.last_name)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            if self._loaded:
+                self._discard(user_id)
+
+    def build(self, rows):
+        """Replace the index contents with (id, role, username, email, first_name, last_name) rows."""
+        # Built without the lock and swapped in, so searches and writes never wait for it
+        staging = UserSearchIndex()
+        for user_id, *fields in rows:
+            staging._add(user_id, _document(*fields), sort_prefix=False)
+        staging._prefix.sort()
+        with self._lock:
+            self._documents, self._grams, self._prefix = staging._documents, staging._grams, staging._prefix
+            self._loaded = True
+
+    def _load(self):
+        # Imported here so the index itself can be used without a database
+        from . import models
+        from .database import SessionLocal
+
+        with self._refreshing:
+            if self._loaded:
+                return
+            # Writes made during the build are dropped by upsert() and picked up by the next refresh
+            watermark = datetime.utcnow()
+            db = SessionLocal()
+            try:
+                columns = [getattr(models.User, field) for field in INDEX_FIELDS]
+                self.build(db.query(*columns).yield_per(10000))
+            finally:
+                db.close()
+            self._watermark = watermark
+            self._last_refresh = time.monotonic()
+
+    def warm(self):
+        """Start building the index on a background thread, once."""
+        with self._lock:
+            if self._loaded or self._warm_thread is not None:
+                return
+            self._warm_thread = threading.Thread(target=self._load, name="search-index-build", daemon=True)
+        self._warm_thread.start()
+
+    def refresh(self, db: Session):
+        """Apply changes made outside this worker; starts the build if the index was not warmed."""
+        from . import crud
+
+        if not self._loaded:
+            self.warm()
+            return
+        if time.monotonic() - self._last_refresh < SEARCH_REFRESH_SECONDS:
+            return
+        # One refresher at a time; the others search the index as it is
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            watermark = datetime.utcnow()
+            deleted_ids = crud.get_deleted_ids_since(db, "user", self._watermark)
+            updated_rows = crud.get_user_rows_updated_since(db, INDEX_FIELDS, self._watermark)
+            with self._lock:
+                for user_id in deleted_ids:
+                    self._discard(user_id)
+                for user_id, *fields in updated_rows:
+                    self._discard(user_id)
+                    self._add(user_id, _document(*fields))
+            self._watermark = watermark
+            self._last_refresh = time.monotonic()
+        finally:
+            self._refreshing.release()
+
+    # Queries
+
+    def _prefix_matches(self, query: str, role: Optional[str]) -> Dict[int, Tuple[int, int]]:
+        """User ID -> score for tokens starting with query, scored like _score."""
+        matches: Dict[int, Tuple[int, int]] = {}
+        position = bisect_left(self._prefix, (query,))
+        end = min(len(self._prefix), position + PREFIX_SCAN_LIMIT)
+        while position < end:
+            token, user_id, weight = self._prefix[position]
+            position += 1
+            if not token.startswith(query):
+                break
+            if role is not None and self._documents[user_id][0] != role:
+                continue
+            score = ((3 if token == query else 2) * 10 + weight, -len(token))
+            if score > matches.get(user_id, (0, 0)):
+                matches[user_id] = score
+        return matches
+
+    def _substring_candidates(self, query: str, role: Optional[str], wanted: int, exclude) -> Set[int]:
+        postings = sorted((self._grams.get(gram, _EMPTY) for gram in _trigrams(query)), key=len)
+        if not postings or not postings[0]:
+            return set()
+        matches = postings[0].intersection(*postings[1:]) if len(postings) > 1 else postings[0]
+        candidates = set()
+        for examined, user_id in enumerate(matches):
+            if examined >= SUBSTRING_SCAN_LIMIT:
+                break
+            if user_id in exclude:
+                continue
+            document = self._documents[user_id]
+            # Trigrams only narrow the candidates down; confirm the substring
+            if (role is None or document[0] == role) and any(query in field for field in document[1:]):
+                candidates.add(user_id)
+                if len(candidates) >= wanted:
+                    break
+        return candidates
+
+    def search(self, query: str, role: Optional[str] = None, limit: int = 10) -> List[int]:
+        """User IDs best matching query, best first."""
+        query = query.strip().lower()
+        if not query:
+            return []
+        with self._lock:
+            scores = self._prefix_matches(query, role)
+            # Substring-only matches always rank below prefix matches, so they
+            # are needed only when the prefix tier cannot fill the page.
+            # Email domains are not in the trigram map.
+            if len(scores) < limit and len(query) >= 3 and "@" not in query:
+                for user_id in self._substring_candidates(query, role, SUBSTRING_RANKING_POOL * limit, scores):
+                    scores[user_id] = _score(self._documents[user_id], query)
+        ranked = heapq.nlargest(limit, ((score, -user_id) for user_id, score in scores.items()))
+        return [-negated_id for _, negated_id in ranked]
+
+
+def database_search(db: Session, query: str, role: Optional[str] = None, limit: int = 10) -> List[int]:
+    """Prefix search with LIKE on the user columns, ranked like the index's prefix tier."""
+    from sqlalchemy import or_
+
+    from . import models
+
+    query = query.strip().lower()
+    if not query:
+        return []
+    pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    columns = [getattr(models.User, field) for field in INDEX_FIELDS]
+    # LIKE, not ILIKE, so MySQL can use the column indexes; its default collation ignores case
+    rows = db.query(*columns).filter(or_(*(
+        getattr(models.User, field).like(pattern, escape="\\") for field in ("username", "email", "first_name", "last_name")
+    )))
+    if role is not None:
+        rows = rows.filter(models.User.role == role)
+    scores = {user_id: _score(_document(*fields), query) for user_id, *fields in rows.limit(PREFIX_SCAN_LIMIT)}
+    ranked = heapq.nlargest(limit, ((score, -user_id) for user_id, score in scores.items()))
+    return [-negated_id for _, negated_id in ranked]
+
+
+user_index = UserSearchIndex()
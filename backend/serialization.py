@@ -0,0 +1,70 @@
+"""
+Fast JSON path for large list endpoints.
+
+The list routes select plain column tuples instead of ORM objects and encode
+them with orjson, skipping the per-row Pydantic model FastAPI would build for
+``response_model``. The selected columns are taken from the response schemas,
+so the payload keeps exactly the same fields and formats (ISO 8601 datetimes,
+enum values) as the validated path.
+
+Responses above ``COMPRESS_MIN_BYTES`` are compressed with brotli (when the
+``brotli`` package is installed) or gzip, depending on ``Accept-Encoding``.
+"""
+
+import gzip
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+from . import conditional, schemas
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+USER_FIELDS: Tuple[str, ...] = tuple(schemas.User.model_fields)
+SESSION_FIELDS: Tuple[str, ...] = tuple(schemas.Session.model_fields)
+
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def rows_to_dicts(fields: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _accepted_encodings(request: Request) -> set:
+    header = request.headers.get("accept-encoding", "")
+    encodings = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def json_response(request: Request, content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Encode content once with orjson and compress it if the client allows."""
+    body = dumps(content)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = _accepted_encodings(request)
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+        if "Content-Encoding" in headers and "ETag" in headers:
+            headers["ETag"] = conditional.encoded_etag(headers["ETag"], headers["Content-Encoding"])
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
@@ -0,0 +1,42 @@
+"""
+Local stand-in for a read replica: copies one SQLite file onto another.
+
+Usage:
+    DATABASE_URL=sqlite:///primary.db DATABASE_REPLICA_URLS=sqlite:///replica.db \
+        uvicorn backend.main:app --port 8001
+    python -m backend.sqlite_replica primary.db replica.db [--interval 1]
+
+The copy uses SQLite's online backup API, so it is consistent and safe while
+the API is writing to the primary. Copying every ``--interval`` seconds gives
+the replica a realistic replication lag, which makes read-your-writes routing
+(see database.py) observable locally.
+"""
+
+import argparse
+import sqlite3
+import time
+
+
+def copy_database(primary_path: str, replica_path: str):
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy a SQLite primary onto a replica file, repeatedly.")
+    parser.add_argument("primary")
+    parser.add_argument("replica")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between copies (replication lag)")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    while True:
+        copy_database(args.primary, args.replica)
+        if args.once:
+            break
+        time.sleep(args.interval)
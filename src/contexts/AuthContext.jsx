@@ -40,51 +40,64 @@ export function AuthProvider({ children }) {
     }
   }, [token, authHeaders]);
 
-  // WebSocket message handler
+  // Apply a single real-time event to local state
+  const applyWsEvent = useCallback((message) => {
+    switch (message.type) {
+      case 'user_created':
+        setUsers(prev => [...prev, message.data.user]);
+        break;
+      case 'user_updated':
+        setUsers(prev => prev.map(u => u.id === message.data.user_id ? message.data.user : u));
+        if (user && user.id === message.data.user_id) {
+          setUser(message.data.user);
+        }
+        break;
+      case 'user_deleted':
+        setUsers(prev => prev.filter(u => u.id !== message.data.user_id));
+        if (user && user.id === message.data.user_id) {
+          setUser(null);
+          setToken(null);
+          localStorage.removeItem('token');
+          localStorage.removeItem('user');
+        }
+        break;
+      case 'session_created':
+        setSessions(prev => [...prev, message.data]);
+        break;
+      case 'session_updated':
+        setSessions(prev => prev.map(s => s.id === message.data.session_id ? { ...s, status: message.data.status, updated_at: message.data.updated_at } : s));
+        break;
+      case 'session_deleted':
+        setSessions(prev => prev.filter(s => s.id !== message.data.session_id));
+        break;
+      default:
+        console.warn('Unknown WebSocket message type:', message.type);
+    }
+  }, [user]);
+
+  // WebSocket message handler; bursts arrive as one "batch" frame
   const handleWsMessage = useCallback((event) => {
     try {
       const message = JSON.parse(event.data);
-      switch (message.type) {
-        case 'user_created':
-          setUsers(prev => [...prev, message.data.user]);
-          break;
-        case 'user_updated':
-          setUsers(prev => prev.map(u => u.id === message.data.user_id ? message.data.user : u));
-          if (user && user.id === message.data.user_id) {
-            setUser(message.data.user);
-          }
-          break;
-        case 'user_deleted':
-          setUsers(prev => prev.filter(u => u.id !== message.data.user_id));
-          if (user && user.id === message.data.user_id) {
-            setUser(null);
-            setToken(null);
-            localStorage.removeItem('token');
-            localStorage.removeItem('user');
-          }
-          break;
-        case 'session_created':
-          setSessions(prev => [...prev, message.data]);
-          break;
-        case 'session_updated':
-          setSessions(prev => prev.map(s => s.id === message.data.session_id ? { ...s, status: message.data.status, updated_at: message.data.updated_at } : s));
-          break;
-        case 'session_deleted':
-          setSessions(prev => prev.filter(s => s.id !== message.data.session_id));
-          break;
-        default:
-          console.warn('Unknown WebSocket message type:', message.type);
+      if (message.type === 'ping') {
+        // Server heartbeat; connections that stop answering are closed
+        event.target.send(JSON.stringify({ type: 'pong' }));
+      } else if (message.type === 'batch') {
+        message.events.forEach(applyWsEvent);
+      } else {
+        applyWsEvent(message);
       }
     } catch (error) {
       console.error('Error handling WebSocket message:', error);
     }
-  }, [user]);
+  }, [applyWsEvent]);
 
   // Setup WebSocket connection
   useEffect(() => {
     if (!token) return;
 
-    const socket = new WebSocket(WS_URL);
+    // The token goes in the subprotocol list, not the URL, so it stays out of server logs
+    const socket = new WebSocket(WS_URL, ['access_token', token]);
     socket.onopen = () => {
       console.log('WebSocket connected');
     };